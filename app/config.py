@@ -1,7 +1,7 @@
 """Application configuration settings."""
 
 import os
-from typing import List
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -26,8 +26,22 @@ class Settings(BaseSettings):
     reload: bool = True
     log_level: str = "info"
     
+    # DEV=1 runs a single auto-reloading process; otherwise run_app starts
+    # WORKERS server processes. Each one loads its own copy of the Magenta
+    # models (hundreds of MB with TensorFlow) and starts its own analysis
+    # process pool, so memory grows roughly linearly with WORKERS; the CPUs
+    # are split between the workers' pools (see cpu_pool_size). Analysis
+    # already fans out to the pool, so one worker is enough for most hosts.
+    dev: bool = False
+    workers: int = 1
+    loop: str = "auto"  # "uvloop" / "asyncio"; auto picks uvloop when installed
+    http: str = "auto"  # "httptools" / "h11"; auto picks httptools when installed
+    limit_concurrency: Optional[int] = None  # Reject with 503 beyond this many connections
+    backlog: int = 2048
+    
     # CORS settings
-    cors_origins: List[str] = ["*"]
+    cors_origins: List[str] = ["*"]  # Set CORS_ORIGINS to the frontend origin(s) in production
+    cors_max_age: int = 86400  # Seconds browsers may cache preflight results
     
     # Directory paths
     generated_arrangements_dir: str = "astro-midi-app/public/generated_arrangements"
@@ -1,7 +1,10 @@
 """Custom exceptions for the application."""
 
+import logging
 from fastapi import HTTPException
 
+logger = logging.getLogger(__name__)
+
 
 class MidiAnalysisError(Exception):
     """Base exception for MIDI analysis errors."""
@@ -35,7 +38,5 @@ class OpenAIAPIError(MidiAnalysisError):
 
 def raise_http_exception(status_code: int, detail: str) -> HTTPException:
     """Helper to raise HTTPException with logging."""
-    import logging
-    logger = logging.getLogger(__name__)
     logger.error(f"HTTP {status_code}: {detail}")
     raise HTTPException(status_code=status_code, detail=detail)
\ No newline at end of file
@@ -1,9 +1,18 @@
 """Clean FastAPI application with proper separation of concerns."""
 
-from fastapi import FastAPI, File, UploadFile, Depends
+import mimetypes
+
+from fastapi import BackgroundTasks, FastAPI, File, UploadFile, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 import uvicorn
 
+try:
+    import orjson  # noqa: F401  (required by ORJSONResponse)
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as DefaultResponse
+
 from .config import settings
 from .models.schemas import (
     ArrangementRequest, VoiceTranscriptionRequest, ChatCompletionRequest,
@@ -21,7 +30,10 @@ from .services.arrangement_service import arrangement_service
 from .services.openai_service import openai_service
 from .services.file_service import file_service
 from .utils.logging import setup_logging, get_logger
-from .utils.helpers import validate_midi_file, ensure_directories_exist
+from .utils.helpers import (
+    validate_midi_file, validate_midi_content_type, ensure_directories_exist, shutdown_cpu_pool,
+    MIDI_EXTENSIONS, MIDI_MEDIA_TYPE
+)
 from .core.middleware import ErrorHandlingMiddleware, RequestLoggingMiddleware
 
 # Setup logging
@@ -32,7 +44,8 @@ logger = get_logger(__name__)
 app = FastAPI(
     title=settings.app_name,
     description=settings.app_description,
-    version=settings.app_version
+    version=settings.app_version,
+    default_response_class=DefaultResponse
 )
 
 # Add middleware (order matters!)
@@ -46,13 +59,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=settings.cors_max_age,
 )
 
 
 # Dependency to validate MIDI files
 def validate_midi_upload(file: UploadFile = File(...)) -> UploadFile:
-    """Validate uploaded MIDI file."""
-    if not validate_midi_file(file.filename):
+    """Validate uploaded MIDI file (before any of it is copied or analyzed)."""
+    if not validate_midi_file(file.filename) or not validate_midi_content_type(file.content_type):
         raise_http_exception(400, "File must be a MIDI file (.mid or .midi)")
     return file
 
@@ -97,6 +111,11 @@ async def startup_event():
         # Load ML models
         await model_service.load_models()
         
+        # Compile the analysis JIT kernels and trace the generation graphs
+        # before the first request
+        analysis_service.warm_up()
+        await arrangement_service.warm_up()
+        
         logger.info("Application startup complete!")
         
     except Exception as e:
@@ -104,6 +123,12 @@ async def startup_event():
         raise e
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release resources on shutdown."""
+    shutdown_cpu_pool()
+
+
 # ============================================================================
 # HEALTH CHECK ENDPOINTS
 # ============================================================================
@@ -152,16 +177,18 @@ async def analyze_chords(
 
 @app.post("/analyze/melody", response_model=MelodyAnalysisResponse)
 async def analyze_melody(
+    background_tasks: BackgroundTasks,
     file: UploadFile = Depends(validate_midi_upload),
     segment_size: int = settings.default_segment_size,
     tolerance_beats: float = settings.default_tolerance_beats
 ):
     """Comprehensive melody analysis with harmonization and visualization."""
-    return await analysis_service.analyze_melody_with_harmonization(file, segment_size, tolerance_beats)
+    return await analysis_service.analyze_melody_with_harmonization(file, segment_size, tolerance_beats, background_tasks)
 
 
 @app.post("/analyze/melody-with-viz")
 async def analyze_melody_with_visualization(
+    background_tasks: BackgroundTasks,
     file: UploadFile = Depends(validate_midi_upload),
     harmonization_style: str = "simple_pop",
     segment_size: int = settings.default_segment_size,
@@ -169,7 +196,7 @@ async def analyze_melody_with_visualization(
 ):
     """Analyze melody and create four-way visualization with FORCED 8-chord rule."""
     return await analysis_service.analyze_melody_with_four_way_viz(
-        file, harmonization_style, segment_size, tolerance_beats
+        file, harmonization_style, segment_size, tolerance_beats, background_tasks
     )
 
 
@@ -202,25 +229,40 @@ async def full_analysis_and_generation(
 # ============================================================================
 
 @app.post("/fix-midi-duration")
-async def fix_midi_duration(file: UploadFile = Depends(validate_midi_upload)):
+async def fix_midi_duration(background_tasks: BackgroundTasks, file: UploadFile = Depends(validate_midi_upload)):
     """Force MIDI file to exactly 9.6 seconds - extend short files, truncate long files."""
-    return await file_service.fix_midi_duration(file)
+    return await file_service.fix_midi_duration(file, background_tasks=background_tasks)
 
 
 # ============================================================================
 # FILE DOWNLOAD ENDPOINTS
 # ============================================================================
 
-@app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Download generated MIDI files."""
-    return await file_service.download_arrangement(filename)
-
-
-@app.get("/download/viz/{filename}")
-async def download_visualization(filename: str):
-    """Download generated visualization files."""
-    return await file_service.download_visualization(filename)
+class GeneratedFiles(StaticFiles):
+    """Static files for generated outputs, which are never rewritten under the same name."""
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        # Every render gets a unique filename, so browsers may cache it for good
+        response.headers.setdefault("Cache-Control", "public, max-age=31536000, immutable")
+        return response
+
+
+# Served by Starlette's static file handler (sendfile, cached stat, ETag, media
+# type from the extension). /download/viz is mounted first so /download doesn't
+# shadow it.
+for extension in MIDI_EXTENSIONS:
+    mimetypes.add_type(MIDI_MEDIA_TYPE, extension)
+app.mount(
+    "/download/viz",
+    GeneratedFiles(directory=settings.generated_visualizations_dir, check_dir=False),
+    name="download_visualization"
+)
+app.mount(
+    "/download",
+    GeneratedFiles(directory=settings.generated_arrangements_dir, check_dir=False),
+    name="download"
+)
 
 
 # ============================================================================
@@ -255,13 +297,28 @@ def run_app():
     logger.info("API docs available at: http://localhost:8000/docs")
     logger.info("Ready for frontend-recorded MIDI files with GUARANTEED 8 chords!")
     
-    uvicorn.run(
-        "app.main:app",
-        host=settings.host,
-        port=settings.port,
-        reload=settings.reload,
-        log_level=settings.log_level
-    )
+    if settings.dev:
+        # Development: single process, restarted on code changes
+        uvicorn.run(
+            "app.main:app",
+            host=settings.host,
+            port=settings.port,
+            reload=settings.reload,
+            log_level=settings.log_level
+        )
+    else:
+        # Production: settings.workers processes, no file watcher
+        uvicorn.run(
+            "app.main:app",
+            host=settings.host,
+            port=settings.port,
+            workers=settings.workers,
+            loop=settings.loop,
+            http=settings.http,
+            limit_concurrency=settings.limit_concurrency,
+            backlog=settings.backlog,
+            log_level=settings.log_level
+        )
 
 
 if __name__ == "__main__":
@@ -1,16 +1,26 @@
 """Pydantic models for API request/response schemas."""
 
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from typing import List, Optional, Dict, Any, Tuple
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ArrangementRequest(BaseModel):
-    chord_progression: List[str]
+    # Immutable request: sequences are validated once into tuples and can be
+    # handed to the generator as-is
+    model_config = ConfigDict(frozen=True)
+    
+    chord_progression: Tuple[str, ...]
     bpm: int = 100
     bass_complexity: int = 1
     drum_complexity: int = 1
-    hi_hat_divisions: int = 2
-    snare_beats: List[int] = [2, 4]
+    # Deprecated: drums are generated without a primer pattern, so these are
+    # accepted for compatibility but ignored
+    hi_hat_divisions: int = Field(
+        2, description="Deprecated and ignored.", json_schema_extra={"deprecated": True}
+    )
+    snare_beats: Tuple[int, ...] = Field(
+        (2, 4), description="Deprecated and ignored.", json_schema_extra={"deprecated": True}
+    )
 
 
 class VoiceTranscriptionRequest(BaseModel):
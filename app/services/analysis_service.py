@@ -1,13 +1,17 @@
 """Service for MIDI analysis operations."""
 
+import asyncio
 import os
-import time
-from typing import Tuple, Dict, Any, List
-from fastapi import UploadFile
+from typing import Tuple, Dict, Any, List, Optional
+from fastapi import BackgroundTasks, UploadFile
 
 from ..config import settings
 from ..core.exceptions import AnalysisFailedError, InvalidMidiFileError
-from ..utils.helpers import save_upload_to_temp, cleanup_temp_file, get_base_filename, ensure_directories_exist
+from ..utils.helpers import (
+    save_upload_with_digest, read_upload_with_digest, schedule_temp_cleanup, get_base_filename,
+    ensure_directories_exist, analysis_cache, run_cpu_bound, start_cpu_pool,
+    unique_timestamp
+)
 from ..utils.logging import get_logger
 
 logger = get_logger(__name__)
@@ -18,8 +22,9 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 try:
-    from chord_analyzer import analyze_chord_progression_with_stretching
+    from chord_analyzer import analyze_chord_progression_with_stretching, warm_up as warm_up_chord_analysis
     from melody_analyzer2 import force_exactly_8_chords_analysis, create_track_visualization, create_four_way_visualization, extract_melody_with_timing
+    from melody_analyzer2 import warm_up as warm_up_melody_analysis
     from chord_or_melody import detect_midi_type, detect_midi_type_with_stretching_and_viz
     ANALYSIS_MODULES_AVAILABLE = True
 except ImportError as e:
@@ -47,6 +52,12 @@ except ImportError as e:
     
     def extract_melody_with_timing(*args, **kwargs):
         return [], []
+    
+    def warm_up_chord_analysis():
+        pass
+    
+    def warm_up_melody_analysis():
+        pass
 
 
 class AnalysisService:
@@ -55,12 +66,29 @@ class AnalysisService:
     def __init__(self):
         ensure_directories_exist(settings.generated_visualizations_dir)
     
+    def warm_up(self) -> None:
+        """Compile the analyzers' JIT kernels so the first request doesn't pay for it."""
+        try:
+            # Compiling here first fills Numba's on-disk cache for the workers
+            warm_up_chord_analysis()
+            warm_up_melody_analysis()
+            if ANALYSIS_MODULES_AVAILABLE:
+                # Spawn the analysis processes and load the kernels in each
+                start_cpu_pool(warm_up_chord_analysis, warm_up_melody_analysis)
+            logger.info("🔥 Analysis kernels warmed up")
+        except Exception as e:
+            logger.warning(f"⚠️ Analysis warm-up failed: {e}")
+    
     async def detect_midi_type(self, file: UploadFile) -> Dict[str, Any]:
         """Detect if uploaded MIDI is chord progression or melody."""
-        temp_path = await save_upload_to_temp(file)
+        # Analyzed straight from memory - no temp file to write or clean up
+        midi_buffer, digest = await read_upload_with_digest(file)
         
         try:
-            midi_type = detect_midi_type(temp_path)
+            midi_type = await analysis_cache.get_or_compute(
+                ("midi_type", digest),
+                lambda: run_cpu_bound(detect_midi_type, midi_buffer)
+            )
             return {
                 "filename": file.filename,
                 "type": midi_type,
@@ -69,8 +97,6 @@ class AnalysisService:
         except Exception as e:
             logger.error(f"MIDI type detection failed for {file.filename}: {e}")
             raise AnalysisFailedError(f"Analysis failed: {str(e)}")
-        finally:
-            cleanup_temp_file(temp_path)
     
     async def analyze_chord_progression(
         self, 
@@ -82,118 +108,174 @@ class AnalysisService:
         segment_size = segment_size or settings.default_segment_size
         tolerance_beats = tolerance_beats or settings.default_tolerance_beats
         
-        temp_path = await save_upload_to_temp(file)
+        midi_buffer, digest = await read_upload_with_digest(file)
         
         try:
-            progression, segments = analyze_chord_progression_with_stretching(
-                temp_path, 
-                segment_size=segment_size, 
-                tolerance_beats=tolerance_beats
+            # Same file and parameters analyzed before -> reuse the result
+            result = await analysis_cache.get_or_compute(
+                ("chords", digest, segment_size, tolerance_beats),
+                lambda: run_cpu_bound(
+                    analyze_chord_progression_with_stretching,
+                    midi_buffer, 
+                    segment_size=segment_size, 
+                    tolerance_beats=tolerance_beats
+                )
             )
             
             return {
                 "filename": file.filename,
-                "chord_progression": progression,
-                "segments": len(segments),
+                "chord_progression": result['chord_progression'],
+                "segments": len(result['segments']),
                 "analysis_type": "chord_progression"
             }
         except Exception as e:
             logger.error(f"Chord analysis failed for {file.filename}: {e}")
             raise AnalysisFailedError(f"Chord analysis failed: {str(e)}")
-        finally:
-            cleanup_temp_file(temp_path)
+    
+    async def _analyze_detected_type(
+        self,
+        temp_path: str,
+        digest: str,
+        detected_type: str,
+        base_name: str,
+        timestamp: str,
+        segment_size: int,
+        tolerance_beats: float
+    ) -> Tuple[Dict[str, Any], bool, Optional[str]]:
+        """Run the analysis (and its visualization) for the detected MIDI type.
+        
+        Returns:
+            (result, viz_success, viz_filename)
+        """
+        viz_success = False
+        viz_filename = None
+        
+        if detected_type == "chord_progression":
+            # Analyze as chord progression
+            result = await run_cpu_bound(
+                analyze_chord_progression_with_stretching,
+                temp_path,
+                segment_size=segment_size,
+                tolerance_beats=tolerance_beats,
+                visualize=True
+            )
+            
+            logger.info(f"✅ Chord progression analysis complete!")
+            logger.info(f"   Detected progression: {' → '.join(result['chord_progression'])}")
+            
+            viz_filename = result.get('visualization_file')
+            viz_success = viz_filename is not None
+        else:
+            # Use forced 8-chord analysis for melody (shared with the four-way
+            # endpoint's cache entry for the same file content)
+            key, progressions, confidences, segments, processed_notes = await analysis_cache.get_or_compute(
+                ("forced_8_chords", digest),
+                lambda: run_cpu_bound(force_exactly_8_chords_analysis, temp_path)
+            )
+            
+            simple_prog, folk_prog, bass_prog, phrase_prog = progressions
+            simple_conf, folk_conf, bass_conf, phrase_conf = confidences
+            
+            logger.info(f"🎼 Melody analysis complete - Key: {key}")
+            logger.info(f"🎵 8-Chord Progressions Generated:")
+            logger.info(f"  Simple: {' → '.join(simple_prog)}")
+            logger.info(f"  Folk: {' → '.join(folk_prog)}")
+            logger.info(f"  Bass: {' → '.join(bass_prog)}")
+            logger.info(f"  Phrase: {' → '.join(phrase_prog)}")
+            
+            # Generate melody visualization
+            viz_filename = f"{base_name}_analysis_{timestamp}.png"
+            
+            try:
+                logger.info("📊 Generating melody visualization...")
+                await run_cpu_bound(
+                    create_track_visualization,
+                    temp_path,
+                    segments,
+                    bass_prog,
+                    phrase_prog,
+                    key,
+                    processed_notes,
+                    viz_filename
+                )
+                viz_success = True
+                logger.info("✅ Melody visualization successful!")
+            except Exception as e:
+                logger.error(f"❌ Track visualization failed: {e}")
+                viz_success = False
+            
+            # Package melody results
+            result = {
+                'analysis_type': 'melody_harmonization',
+                'key': key,
+                'chord_progression': simple_prog,
+                'harmonizations': {
+                    'simple_pop': {'progression': simple_prog, 'confidence': simple_conf},
+                    'folk_acoustic': {'progression': folk_prog, 'confidence': folk_conf},
+                    'bass_foundation': {'progression': bass_prog, 'confidence': bass_conf},
+                    'phrase_foundation': {'progression': phrase_prog, 'confidence': phrase_conf}
+                },
+                'segments': segments,
+                'processed_notes': processed_notes,
+                'forced_8_chords': True,
+                'visualization_file': viz_filename if viz_success else None
+            }
+        
+        return result, viz_success, viz_filename
     
     async def analyze_melody_with_harmonization(
         self, 
         file: UploadFile,
         segment_size: int = None,
-        tolerance_beats: float = None
+        tolerance_beats: float = None,
+        background_tasks: Optional[BackgroundTasks] = None
     ) -> Dict[str, Any]:
         """Comprehensive melody analysis with harmonization and visualization."""
         segment_size = segment_size or settings.default_segment_size
         tolerance_beats = tolerance_beats or settings.default_tolerance_beats
         
-        temp_path = await save_upload_to_temp(file)
+        temp_path, digest = await save_upload_with_digest(file)
         
         try:
             logger.info("🎵 STEP 1: CHORD/MELODY DETECTION")
             
-            # Detect type with visualization
-            detected_type, chord_melody_viz_file = detect_midi_type_with_stretching_and_viz(
-                temp_path, 
-                output_dir=settings.generated_visualizations_dir
-            )
+            # The detection plot needs the full parse, so on a cache miss the
+            # classification comes from the same job that renders it
+            detection = None
+            
+            async def classify_and_plot():
+                nonlocal detection
+                detection = await run_cpu_bound(
+                    detect_midi_type_with_stretching_and_viz,
+                    temp_path,
+                    output_dir=settings.generated_visualizations_dir
+                )
+                return detection[0]
+            
+            detected_type = await analysis_cache.get_or_compute(("midi_type", digest), classify_and_plot)
             
             logger.info(f"🎵 STEP 2: {detected_type.upper()} ANALYSIS + VISUALIZATION")
             
-            timestamp = int(time.time())
+            timestamp = unique_timestamp()
             base_name = get_base_filename(file.filename)
-            viz_success = False
-            viz_filename = None
+            analysis = self._analyze_detected_type(
+                temp_path, digest, detected_type, base_name, timestamp, segment_size, tolerance_beats
+            )
             
-            if detected_type == "chord_progression":
-                # Analyze as chord progression
-                result = analyze_chord_progression_with_stretching(
-                    temp_path,
-                    segment_size=segment_size,
-                    tolerance_beats=tolerance_beats
+            if detection is None:
+                # Type was already cached: render the detection plot in
+                # parallel with the type-specific analysis
+                (_, chord_melody_viz_file), (result, viz_success, viz_filename) = await asyncio.gather(
+                    run_cpu_bound(
+                        detect_midi_type_with_stretching_and_viz,
+                        temp_path, 
+                        output_dir=settings.generated_visualizations_dir
+                    ),
+                    analysis
                 )
-                
-                logger.info(f"✅ Chord progression analysis complete!")
-                logger.info(f"   Detected progression: {' → '.join(result['chord_progression'])}")
-                
-                viz_filename = result.get('visualization_file')
-                viz_success = viz_filename is not None
             else:
-                # Use forced 8-chord analysis for melody
-                key, progressions, confidences, segments, processed_notes = force_exactly_8_chords_analysis(temp_path)
-                
-                simple_prog, folk_prog, bass_prog, phrase_prog = progressions
-                simple_conf, folk_conf, bass_conf, phrase_conf = confidences
-                
-                logger.info(f"🎼 Melody analysis complete - Key: {key}")
-                logger.info(f"🎵 8-Chord Progressions Generated:")
-                logger.info(f"  Simple: {' → '.join(simple_prog)}")
-                logger.info(f"  Folk: {' → '.join(folk_prog)}")
-                logger.info(f"  Bass: {' → '.join(bass_prog)}")
-                logger.info(f"  Phrase: {' → '.join(phrase_prog)}")
-                
-                # Generate melody visualization
-                viz_filename = f"{base_name}_analysis_{timestamp}.png"
-                
-                try:
-                    logger.info("📊 Generating melody visualization...")
-                    create_track_visualization(
-                        temp_path,
-                        segments,
-                        bass_prog,
-                        phrase_prog,
-                        key,
-                        processed_notes,
-                        viz_filename
-                    )
-                    viz_success = True
-                    logger.info("✅ Melody visualization successful!")
-                except Exception as e:
-                    logger.error(f"❌ Track visualization failed: {e}")
-                    viz_success = False
-                
-                # Package melody results
-                result = {
-                    'analysis_type': 'melody_harmonization',
-                    'key': key,
-                    'chord_progression': simple_prog,
-                    'harmonizations': {
-                        'simple_pop': {'progression': simple_prog, 'confidence': simple_conf},
-                        'folk_acoustic': {'progression': folk_prog, 'confidence': folk_conf},
-                        'bass_foundation': {'progression': bass_prog, 'confidence': bass_conf},
-                        'phrase_foundation': {'progression': phrase_prog, 'confidence': phrase_conf}
-                    },
-                    'segments': segments,
-                    'processed_notes': processed_notes,
-                    'forced_8_chords': True,
-                    'visualization_file': viz_filename if viz_success else None
-                }
+                chord_melody_viz_file = detection[1]
+                result, viz_success, viz_filename = await analysis
             
             logger.info("🎵 ANALYSIS COMPLETE - RETURNING RESULTS")
             
@@ -244,25 +326,30 @@ class AnalysisService:
             logger.error(f"MIDI analysis error for {file.filename}: {e}")
             raise AnalysisFailedError(f"MIDI analysis failed: {str(e)}")
         finally:
-            cleanup_temp_file(temp_path)
+            schedule_temp_cleanup(temp_path, background_tasks)
     
     async def analyze_melody_with_four_way_viz(
         self,
         file: UploadFile,
         harmonization_style: str = "simple_pop",
         segment_size: int = None,
-        tolerance_beats: float = None
+        tolerance_beats: float = None,
+        background_tasks: Optional[BackgroundTasks] = None
     ) -> Dict[str, Any]:
         """Analyze melody and create four-way visualization."""
         segment_size = segment_size or settings.default_segment_size
         tolerance_beats = tolerance_beats or settings.default_tolerance_beats
         
-        temp_path = await save_upload_to_temp(file)
+        temp_path, digest = await save_upload_with_digest(file)
         
         try:
-            # Analyze melody with forced 8-chord analysis
+            # Analyze melody with forced 8-chord analysis (cached per file content,
+            # so trying each harmonization style on one upload analyzes it once)
             logger.info(f"🎵 Analyzing melody for chord progression: {file.filename}")
-            key, progressions, confidences, segments, _ = force_exactly_8_chords_analysis(temp_path)
+            key, progressions, confidences, segments, processed_notes = await analysis_cache.get_or_compute(
+                ("forced_8_chords", digest),
+                lambda: run_cpu_bound(force_exactly_8_chords_analysis, temp_path)
+            )
             
             simple_prog, folk_prog, bass_prog, phrase_prog = progressions
             simple_conf, folk_conf, bass_conf, phrase_conf = confidences
@@ -284,24 +371,23 @@ class AnalysisService:
             logger.info(f"🎯 Key: {key}, Confidence: {selected_confidence:.1f}%")
             
             # Create four-way visualization
-            timestamp = int(time.time())
+            timestamp = unique_timestamp()
             base_name = get_base_filename(file.filename)
             viz_filename = f"{base_name}_{harmonization_style}_{timestamp}_four_ways.png"
             viz_path = os.path.join(settings.generated_visualizations_dir, viz_filename)
             
             logger.info("📊 Creating four-way chord progression visualization...")
             try:
-                # Extract notes for visualization
-                extracted_notes, _ = extract_melody_with_timing(temp_path, tolerance_beats=tolerance_beats)
-                
-                # Use existing four-way visualization function
-                create_four_way_visualization(
+                # Reuse the notes the analysis already parsed instead of
+                # reading the MIDI file a second time
+                await run_cpu_bound(
+                    create_four_way_visualization,
                     temp_path,
                     segments,
                     bass_prog,
                     phrase_prog,
                     key,
-                    extracted_notes,
+                    processed_notes,
                     viz_path
                 )
                 viz_success = True
@@ -344,7 +430,7 @@ class AnalysisService:
             logger.error(f"MIDI melody analysis error for {file.filename}: {e}")
             raise AnalysisFailedError(f"MIDI melody analysis failed: {str(e)}")
         finally:
-            cleanup_temp_file(temp_path)
+            schedule_temp_cleanup(temp_path, background_tasks)
 
 
 # Global analysis service instance
@@ -1,14 +1,20 @@
 """Service for arrangement generation operations."""
 
+import asyncio
+import functools
 import os
-import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
 from fastapi import UploadFile
 
 from ..config import settings
 from ..core.exceptions import ArrangementGenerationError, ModelNotLoadedError
 from ..core.model_manager import model_service
-from ..utils.helpers import save_upload_to_temp, cleanup_temp_file, get_base_filename, ensure_directories_exist
+from ..utils.helpers import (
+    read_upload_with_digest, cleanup_temp_file, get_base_filename, ensure_directories_exist,
+    analysis_cache, run_cpu_bound, unique_timestamp, UPLOAD_TEMP_DIR
+)
 from ..utils.logging import get_logger
 from ..models.schemas import ArrangementRequest
 
@@ -21,10 +27,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 # Try importing optional analysis modules
 try:
-    from arrangement_generator import generate_arrangement_from_chords
-    from chord_or_melody import detect_midi_type
-    from chord_analyzer import analyze_chord_progression_with_stretching
-    from melody_analyzer2 import force_exactly_8_chords_analysis
+    from arrangement_generator import generate_arrangement_from_chords, start_model_loading
+    from chord_or_melody import detect_and_analyze_midi
     ANALYSIS_MODULES_AVAILABLE = True
 except ImportError as e:
     logger.warning(f"Analysis modules not available: {e}. Arrangement service running in limited mode.")
@@ -34,14 +38,39 @@ except ImportError as e:
     def generate_arrangement_from_chords(*args, **kwargs):
         raise ArrangementGenerationError("Magenta not available - cannot generate arrangements")
     
-    def detect_midi_type(*args, **kwargs):
-        return "unknown"
+    def start_model_loading():
+        pass
     
-    def analyze_chord_progression_with_stretching(*args, **kwargs):
-        return [], []
-    
-    def force_exactly_8_chords_analysis(*args, **kwargs):
-        return "C", [["C", "F", "G", "C", "Am", "F", "G", "C"]] * 4, [0.5] * 4, [], []
+    def detect_and_analyze_midi(*args, **kwargs):
+        return "unknown", ("C", [["C", "F", "G", "C", "Am", "F", "G", "C"]] * 4, [0.5] * 4, [], [])
+
+
+# Arrangement requests are queued onto one dedicated generation thread.
+# Magenta's generators take a single primer per call (there is no batched
+# generate), so requests can't be stacked into one model call; running them
+# in arrival order off the event loop keeps the API responsive meanwhile.
+_generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arrangement")
+
+# ArrangementRequest fields that no longer affect generation (drums are
+# generated without a primer pattern)
+_DEPRECATED_REQUEST_FIELDS = {"hi_hat_divisions", "snare_beats"}
+
+# Harmonization styles in the order force_exactly_8_chords_analysis returns them
+_STYLE_INDEX = {
+    "simple_pop": 0,
+    "folk_acoustic": 1,
+    "bass_foundation": 2,
+    "phrase_foundation": 3
+}
+_STYLE_KEYS = tuple(_STYLE_INDEX)
+
+
+async def _run_generation(**kwargs) -> str:
+    """Run generate_arrangement_from_chords on the generation thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _generation_executor, functools.partial(generate_arrangement_from_chords, **kwargs)
+    )
 
 
 class ArrangementService:
@@ -50,27 +79,57 @@ class ArrangementService:
     def __init__(self):
         ensure_directories_exist(settings.generated_arrangements_dir)
     
+    async def warm_up(self) -> None:
+        """Run one short generation so the first request doesn't pay for TF graph tracing."""
+        # Start the generator's shared model load (a no-op if it's already running)
+        start_model_loading()
+        
+        if not model_service.is_loaded():
+            return
+        
+        fd, warm_up_file = tempfile.mkstemp(suffix=".mid", dir=UPLOAD_TEMP_DIR)
+        os.close(fd)
+        try:
+            await _run_generation(
+                chord_progression=["C", "G", "Am", "F"],
+                bpm=settings.default_bpm,
+                bass_complexity=1,
+                drum_complexity=1,
+                output_file=warm_up_file,
+                bass_rnn=model_service.get_bass_rnn(),
+                drum_rnn=model_service.get_drum_rnn(),
+                loop_count=1
+            )
+            logger.info("🔥 Arrangement models warmed up")
+        except Exception as e:
+            logger.warning(f"⚠️ Arrangement warm-up failed: {e}")
+        finally:
+            cleanup_temp_file(warm_up_file)
+    
     async def generate_from_chord_progression(self, request: ArrangementRequest) -> Dict[str, Any]:
         """Generate arrangement from chord progression."""
         if not model_service.is_loaded():
             raise ModelNotLoadedError("Models not loaded")
         
-        if not request.chord_progression:
+        progression = request.chord_progression
+        if not progression:
             raise ArrangementGenerationError("Chord progression cannot be empty")
         
+        ignored_fields = sorted(request.model_fields_set & _DEPRECATED_REQUEST_FIELDS)
+        if ignored_fields:
+            logger.warning(f"⚠️ Ignoring deprecated arrangement fields: {', '.join(ignored_fields)}")
+        
         try:
             # Generate unique filename
-            timestamp = int(time.time())
+            timestamp = unique_timestamp()
             output_file = os.path.join(settings.generated_arrangements_dir, f"arrangement_{timestamp}.mid")
             
             # Generate arrangement
-            result_file = generate_arrangement_from_chords(
-                chord_progression=request.chord_progression,
+            result_file = await _run_generation(
+                chord_progression=progression,
                 bpm=request.bpm,
                 bass_complexity=request.bass_complexity,
                 drum_complexity=request.drum_complexity,
-                hi_hat_divisions=request.hi_hat_divisions,
-                snare_beats=tuple(request.snare_beats),
                 output_file=output_file,
                 bass_rnn=model_service.get_bass_rnn(),
                 drum_rnn=model_service.get_drum_rnn()
@@ -78,7 +137,7 @@ class ArrangementService:
             
             return {
                 "message": "Arrangement generated successfully!",
-                "chord_progression": request.chord_progression,
+                "chord_progression": progression,
                 "settings": {
                     "bpm": request.bpm,
                     "bass_complexity": request.bass_complexity,
@@ -105,51 +164,46 @@ class ArrangementService:
             raise ModelNotLoadedError("Models not loaded")
         
         bpm = bpm or settings.default_bpm
-        temp_path = await save_upload_to_temp(file)
+        # Analyzed straight from memory - no temp file to write or clean up
+        midi_buffer, digest = await read_upload_with_digest(file)
         
         try:
-            # Step 1: Detect type
-            midi_type = detect_midi_type(temp_path)
+            # Steps 1-2: Detect type and analyze accordingly (chord progression
+            # analysis, or forced 8-chord analysis for melody) on one parse
+            midi_type, analysis = await analysis_cache.get_or_compute(
+                ("full_analysis", digest),
+                lambda: run_cpu_bound(detect_and_analyze_midi, midi_buffer)
+            )
             
-            # Step 2: Analyze based on type
             if midi_type == "chord_progression":
-                progression, segments = analyze_chord_progression_with_stretching(temp_path)
-                chord_list = progression
-                analysis_data = {"type": "chord_progression", "progression": progression}
+                # analyze_chord_progression_with_stretching result dict
+                chord_list = analysis['chord_progression']
+                analysis_data = {"type": "chord_progression", "progression": chord_list}
             else:
-                # Use forced 8-chord analysis for melody
-                key, progressions, confidences, segments, _ = force_exactly_8_chords_analysis(temp_path)
+                # force_exactly_8_chords_analysis result: (key, progressions, ...)
+                key, progressions = analysis[0], analysis[1]
                 
                 # Select harmonization style
-                style_map = {
-                    "simple_pop": 0,
-                    "folk_acoustic": 1, 
-                    "bass_foundation": 2,
-                    "phrase_foundation": 3
-                }
-                
-                style_index = style_map.get(harmonization_style, 0)
+                style_index = _STYLE_INDEX.get(harmonization_style, 0)
                 chord_list = progressions[style_index]
                 
                 analysis_data = {
                     "type": "melody",
                     "key": key,
                     "selected_style": harmonization_style,
-                    "all_harmonizations": dict(zip(style_map.keys(), progressions))
+                    "all_harmonizations": dict(zip(_STYLE_KEYS, progressions))
                 }
             
             # Step 3: Generate arrangement
-            timestamp = int(time.time())
+            timestamp = unique_timestamp()
             base_name = get_base_filename(file.filename)
             output_file = os.path.join(settings.generated_arrangements_dir, f"{base_name}_arrangement_{timestamp}.mid")
             
-            result_file = generate_arrangement_from_chords(
+            result_file = await _run_generation(
                 chord_progression=chord_list,
                 bpm=bpm,
                 bass_complexity=bass_complexity,
                 drum_complexity=drum_complexity,
-                hi_hat_divisions=2,
-                snare_beats=(2, 4),
                 output_file=output_file,
                 bass_rnn=model_service.get_bass_rnn(),
                 drum_rnn=model_service.get_drum_rnn()
@@ -167,8 +221,6 @@ class ArrangementService:
         except Exception as e:
             logger.error(f"Full analysis and generation failed for {file.filename}: {e}")
             raise ArrangementGenerationError(f"Full analysis failed: {str(e)}")
-        finally:
-            cleanup_temp_file(temp_path)
 
 
 # Global arrangement service instance
@@ -6,6 +6,7 @@ from typing import Dict, Any, Optional
 
 from ..config import settings
 from ..core.exceptions import OpenAIAPIError
+from ..utils.helpers import run_blocking
 from ..utils.logging import get_logger
 from ..models.schemas import ChatCompletionRequest
 
@@ -102,7 +103,7 @@ class OpenAIService:
         }
         
         try:
-            result = self._make_request(payload)
+            result = await run_blocking(self._make_request, payload)
             ai_response = result["choices"][0]["message"]["content"]
             
             # Parse the JSON response
@@ -178,7 +179,7 @@ class OpenAIService:
             "temperature": 0.7
         }
         
-        result = self._make_request(payload)
+        result = await run_blocking(self._make_request, payload)
         ai_response = result["choices"][0]["message"]["content"]
         
         return {"response": ai_response}
@@ -1,39 +1,138 @@
 """Utility helper functions."""
 
+import asyncio
+import functools
+import hashlib
+import inspect
+import io
+import itertools
+import multiprocessing
 import os
+import sys
 import tempfile
-from fastapi import UploadFile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Tuple
+from fastapi import BackgroundTasks, UploadFile
+
+from ..config import settings
+
+try:
+    import aiofiles
+    AIOFILES_AVAILABLE = True
+except ImportError:
+    # aiofiles is optional - uploads are then written with regular file I/O
+    AIOFILES_AVAILABLE = False
+
+# Accepted MIDI upload extensions and content types (browsers send audio/midi,
+# generic clients such as curl send application/octet-stream)
+MIDI_EXTENSIONS = ('.mid', '.midi')
+MIDI_MEDIA_TYPE = 'audio/midi'  # Content type of the MIDI files we serve
+MIDI_CONTENT_TYPES = frozenset({
+    'audio/midi', 'audio/mid', 'audio/x-midi', 'audio/x-mid',
+    'application/x-midi', 'application/octet-stream'
+})
+
+# Uploads are copied to disk in chunks of this size instead of being read whole
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Spooled uploads go to tmpfs when available (Linux /dev/shm), so writing and
+# re-reading them never touches the disk; None means the system temp dir
+UPLOAD_TEMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
 
 
 def validate_midi_file(filename: str) -> bool:
     """Validate if file is a MIDI file by extension."""
-    return filename.lower().endswith(('.mid', '.midi'))
+    return bool(filename) and filename.lower().endswith(MIDI_EXTENSIONS)
+
+
+def validate_midi_content_type(content_type: str) -> bool:
+    """Validate the upload's declared content type (a missing one is allowed)."""
+    return not content_type or content_type.split(';', 1)[0].strip().lower() in MIDI_CONTENT_TYPES
 
 
 async def save_upload_to_temp(file: UploadFile, suffix: str = '.mid') -> str:
     """Save uploaded file to temporary location and return path."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        content = await file.read()
-        temp_file.write(content)
-        return temp_file.name
+    temp_path, _ = await save_upload_with_digest(file, suffix)
+    return temp_path
+
+
+async def save_upload_with_digest(file: UploadFile, suffix: str = '.mid') -> Tuple[str, str]:
+    """Save uploaded file to temporary location; return path and BLAKE2b hash of its content."""
+    digest = hashlib.blake2b(digest_size=16)
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_TEMP_DIR)
+    try:
+        if AIOFILES_AVAILABLE and UPLOAD_TEMP_DIR is None:
+            # Spooling to disk: write off the event loop so concurrent uploads
+            # don't wait on each other's I/O (tmpfs writes are memory copies)
+            os.close(fd)
+            async with aiofiles.open(temp_path, 'wb') as temp_file:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    await temp_file.write(chunk)
+        else:
+            with os.fdopen(fd, 'wb') as temp_file:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+    except BaseException:
+        cleanup_temp_file(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+async def read_upload_with_digest(file: UploadFile) -> Tuple[io.BytesIO, str]:
+    """Read uploaded file into memory; return the buffer and BLAKE2b hash of its content."""
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = io.BytesIO()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer, digest.hexdigest()
 
 
 def cleanup_temp_file(file_path: str) -> None:
     """Safely remove temporary file."""
     try:
-        if os.path.exists(file_path):
-            os.unlink(file_path)
+        # Unlink directly instead of checking os.path.exists first: one
+        # syscall, and no race between the check and the removal
+        os.unlink(file_path)
     except Exception:
-        # Silently ignore cleanup failures
+        # Silently ignore cleanup failures (including an already-removed file)
         pass
 
 
+def schedule_temp_cleanup(file_path: str, background_tasks: Optional[BackgroundTasks] = None) -> None:
+    """
+    Remove a temporary file after the response has been sent.
+    
+    The file is removed right away when there are no background tasks, or when
+    called while an exception is propagating (error responses don't run them).
+    """
+    if background_tasks is None or sys.exc_info()[0] is not None:
+        cleanup_temp_file(file_path)
+    else:
+        background_tasks.add_task(cleanup_temp_file, file_path)
+
+
 def ensure_directories_exist(*directories: str) -> None:
     """Ensure multiple directories exist, creating them if necessary."""
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
 
+# Per-process sequence number that keeps output names distinct even when two
+# requests land on the same clock tick
+_filename_counter = itertools.count()
+
+
+def unique_timestamp() -> str:
+    """Return a timestamp string that is unique within this process, for output filenames."""
+    return f"{time.time_ns()}_{next(_filename_counter)}"
+
+
 def get_base_filename(filename: str) -> str:
     """Extract base filename without extension."""
     return os.path.splitext(filename or "uploaded")[0]
@@ -41,4 +140,115 @@ def get_base_filename(filename: str) -> str:
 
 def build_download_url(base_path: str, filename: str) -> str:
     """Build download URL for generated files."""
-    return f"/download/{base_path}/{filename}" if filename else None
\ No newline at end of file
+    return f"/download/{base_path}/{filename}" if filename else None
+
+
+class ResultCache:
+    """Bounded LRU cache of analysis results, keyed by upload content hash + parameters."""
+    
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        # key -> [lock, number of callers holding or waiting on it]
+        self._locks = {}
+    
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached result for key, computing it (once per key) on a miss.
+        compute may return the result or an awaitable of it.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        
+        # Concurrent uploads of the same file wait for one computation
+        lock_entry = self._locks.get(key)
+        if lock_entry is None:
+            lock_entry = self._locks[key] = [asyncio.Lock(), 0]
+        lock_entry[1] += 1
+        try:
+            async with lock_entry[0]:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+                
+                result = compute()
+                if inspect.isawaitable(result):
+                    result = await result
+                self._entries[key] = result
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return result
+        finally:
+            # Only the last caller drops the lock, so waiters queued behind a
+            # failed computation keep sharing it with later callers
+            lock_entry[1] -= 1
+            if lock_entry[1] == 0 and self._locks.get(key) is lock_entry:
+                del self._locks[key]
+
+
+# Shared cache for analyses of uploaded MIDI files
+analysis_cache = ResultCache()
+
+
+# Process pool for the CPU-bound analyzers, so they run in parallel outside
+# the GIL instead of blocking the event loop (created on first use)
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+
+def cpu_pool_size() -> int:
+    """Number of analysis processes (the CPUs shared between the server's worker processes)."""
+    server_workers = 1 if settings.dev else max(1, settings.workers)
+    return max(1, (os.cpu_count() or 1) // server_workers)
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """Return the shared analysis process pool."""
+    global _cpu_pool
+    if _cpu_pool is None:
+        # spawn, not fork: a forked worker would inherit the server's threads
+        # and loaded TensorFlow models
+        _cpu_pool = ProcessPoolExecutor(
+            max_workers=cpu_pool_size(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _cpu_pool
+
+
+def start_cpu_pool(*warm_up_funcs: Callable[[], Any]) -> None:
+    """
+    Start the analysis processes ahead of the first request.
+    
+    Args:
+        warm_up_funcs: Module-level functions to run in the workers (e.g. to
+            compile JIT kernels); submitted once per worker, not awaited
+    """
+    pool = get_cpu_pool()
+    for _ in range(cpu_pool_size()):
+        for func in warm_up_funcs:
+            pool.submit(func)
+
+
+async def run_cpu_bound(func: Callable, *args, **kwargs) -> Any:
+    """Run a CPU-bound (module-level, picklable) function in the analysis process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), functools.partial(func, *args, **kwargs))
+
+
+# Threads for blocking I/O-bound calls (file rewrites, outbound HTTP) made
+# from async handlers
+_blocking_pool = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1), thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function on the shared thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_pool, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_cpu_pool() -> None:
+    """Stop the analysis process pool (on application shutdown)."""
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
@@ -26,15 +26,56 @@ WORKFLOW:
 """
 
 from note_seq.protobuf import generator_pb2  
-from model_manager import MagentaModelManager
+from note_seq.protobuf import music_pb2
+from model_manager import get_models
 import note_seq  
+import numpy as np
+import mido
 import copy
+import threading
 
 # Bass guitar range (4-string standard tuning E-A-D-G)
 BASS_MIN_MIDI = 28  # E1 (low E string)
 BASS_MAX_MIDI = 67  # G4 (high end of G string, though typically played lower)
 BASS_PRACTICAL_MAX = 55  # G3 (more typical upper range for bass lines)
 
+# Models are warmed up in a background thread, started explicitly with
+# start_model_loading() (or on first use) rather than at import time
+_preloaded_models = None
+_models_ready = threading.Event()
+_init_thread = None
+_init_lock = threading.Lock()
+
+def _load_models():
+    """Load the shared Magenta models and signal that they are ready."""
+    global _preloaded_models
+    try:
+        _preloaded_models = get_models()
+    except Exception as e:
+        print(f"Background model loading failed: {e}")
+    finally:
+        _models_ready.set()
+
+def start_model_loading():
+    """Start loading the shared Magenta models in a background thread (only once)."""
+    global _init_thread
+    with _init_lock:
+        if _init_thread is None:
+            _init_thread = threading.Thread(target=_load_models, daemon=True)
+            _init_thread.start()
+
+def _wait_for_models():
+    """
+    Wait for the background model load to finish (starting it if needed).
+    Returns: (bass_rnn, drum_rnn)
+    """
+    start_model_loading()
+    _models_ready.wait()
+    if _preloaded_models is None:
+        # Background load failed - retry here so the error reaches the caller
+        return get_models()
+    return _preloaded_models
+
 def chord_name_to_midi_note(chord_name, octave=3):
     """
     Convert chord name (like 'C', 'F#m', 'Dm') to MIDI note number.
@@ -208,13 +249,81 @@ def apply_bass_improvements(bass_sequence, chord_progression, chord_duration):
     
     return bass_sequence
 
+def write_arrangement_midi(notes, loop_count, loop_duration, bpm, output_file, ticks_per_quarter=220):
+    """
+    Write the looped arrangement straight to a MIDI file with mido.
+    Skips building a looped NoteSequence just to serialize it.
+    
+    Args:
+        notes: Notes of a single loop (bass + drums)
+        loop_count: Number of times to repeat the loop
+        loop_duration: Duration of a single loop in seconds
+        bpm: Tempo in beats per minute
+        output_file: Path of the MIDI file to write
+        ticks_per_quarter: MIDI resolution
+    
+    Returns:
+        Path to the written MIDI file
+    """
+    note_count = len(notes)
+    
+    # Columnar view of the single loop
+    pitches = np.fromiter((n.pitch for n in notes), dtype=np.int64, count=note_count)
+    velocities = np.fromiter((n.velocity for n in notes), dtype=np.int64, count=note_count)
+    starts = np.fromiter((n.start_time for n in notes), dtype=np.float64, count=note_count)
+    ends = np.fromiter((n.end_time for n in notes), dtype=np.float64, count=note_count)
+    is_drum = np.fromiter((n.is_drum for n in notes), dtype=bool, count=note_count)
+    
+    # Tile the loop with per-loop time offsets
+    offsets = np.repeat(np.arange(loop_count) * loop_duration, note_count)
+    pitches = np.tile(pitches, loop_count)
+    velocities = np.tile(velocities, loop_count)
+    starts = np.tile(starts, loop_count) + offsets
+    ends = np.tile(ends, loop_count) + offsets
+    is_drum = np.tile(is_drum, loop_count)
+    
+    ticks_per_second = ticks_per_quarter * bpm / 60
+    start_ticks = np.round(starts * ticks_per_second).astype(np.int64)
+    end_ticks = np.round(ends * ticks_per_second).astype(np.int64)
+    
+    midi_file = mido.MidiFile(type=1, ticks_per_beat=ticks_per_quarter)
+    
+    # Tempo/meter track
+    meta_track = mido.MidiTrack()
+    meta_track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(bpm), time=0))
+    meta_track.append(mido.MetaMessage('time_signature', numerator=4, denominator=4, time=0))
+    midi_file.tracks.append(meta_track)
+    
+    # Bass (channel 0, Electric Bass (finger)) and drums (channel 9)
+    for channel, program, mask in ((0, 33, ~is_drum), (9, 0, is_drum)):
+        track = mido.MidiTrack()
+        track.append(mido.Message('program_change', channel=channel, program=program, time=0))
+        
+        # Note-offs sort before note-ons on the same tick
+        event_ticks = np.concatenate((end_ticks[mask], start_ticks[mask]))
+        event_is_on = np.concatenate((np.zeros(mask.sum(), dtype=bool), np.ones(mask.sum(), dtype=bool)))
+        event_pitches = np.concatenate((pitches[mask], pitches[mask]))
+        event_velocities = np.concatenate((np.zeros(mask.sum(), dtype=np.int64), velocities[mask]))
+        
+        order = np.lexsort((event_is_on, event_ticks))
+        deltas = np.diff(event_ticks[order], prepend=0)
+        
+        for delta, on, pitch, velocity in zip(deltas.tolist(), event_is_on[order].tolist(),
+                                              event_pitches[order].tolist(), event_velocities[order].tolist()):
+            track.append(mido.Message('note_on' if on else 'note_off', channel=channel,
+                                      note=pitch, velocity=velocity, time=delta))
+        midi_file.tracks.append(track)
+    
+    midi_file.save(output_file)
+    return output_file
+
 def generate_arrangement_from_chords(
     chord_progression,               # List of 8 chord names (e.g., ['C', 'G', 'Am', 'F', ...])
     bpm=100,                        # Fixed tempo for MVP
     bass_complexity=2,              # Temperature for bass generation
     drum_complexity=1,              # Temperature for drum generation
-    hi_hat_divisions=5,             # Divisions per beat for hi-hat
-    snare_beats=(2, 4),             # Which beats get snare hits
+    hi_hat_divisions=5,             # Deprecated, ignored - drums are generated without a primer pattern
+    snare_beats=(2, 4),             # Deprecated, ignored - drums are generated without a primer pattern
     output_file='generated_arrangement.mid',
     bass_rnn=None,                  # Pre-initialized bass generator
     drum_rnn=None,                  # Pre-initialized drum generator
@@ -228,11 +337,15 @@ def generate_arrangement_from_chords(
     Enhanced features:
     - Bass notes limited to 4-string bass range
     - Filler bass notes follow pentatonic scales
+    
+    hi_hat_divisions and snare_beats are deprecated and ignored: the drum RNN
+    samples its pattern from an empty primer.
     """
     
-    # Initialize models if not provided
+    # Reuse the shared, already-initialized models if not provided so the
+    # bass/drum TF graphs and sessions are never rebuilt per arrangement
     if bass_rnn is None or drum_rnn is None:
-        bass_rnn, drum_rnn = MagentaModelManager.initialize_models()
+        bass_rnn, drum_rnn = _wait_for_models()
     
     print(f"🎵 Generating enhanced arrangement from chord progression: {' → '.join(chord_progression)}")
     print(f"🔄 Will loop the arrangement {loop_count} times")
@@ -266,18 +379,20 @@ def generate_arrangement_from_chords(
     )
     
     # Add chord roots (each lasting 2 beats) - these are already in bass range
-    for i, pitch in enumerate(chord_roots):
-        start = i * chord_duration
-        end = (i + 1) * chord_duration
-        seed.notes.add(
-            pitch=pitch,
+    starts = np.arange(len(chord_roots)) * chord_duration
+    seed.notes.extend([
+        music_pb2.NoteSequence.Note(
+            pitch=int(pitch),
             velocity=100,
-            start_time=start,
-            end_time=end,
+            start_time=float(start),
+            end_time=float(start + chord_duration),
             is_drum=False
         )
+        for pitch, start in zip(chord_roots, starts)
+    ])
     
-    # Create drum seed with basic pattern (2 beats = one chord duration)
+    # Drum primer carries only tempo/meter - the drum RNN samples the whole
+    # pattern from the start, conditioned on metrical position
     drum_seed = note_seq.NoteSequence()
     drum_seed.ticks_per_quarter = seed.ticks_per_quarter
     drum_seed.tempos.extend(seed.tempos)
@@ -287,46 +402,6 @@ def generate_arrangement_from_chords(
         time=0
     )
     
-    # Create a 2-beat drum pattern that matches our chord duration
-    for beat in range(2):  # 2 beats per chord
-        beat_time = beat * beat_s
-        
-        # Kick on beat 1
-        if beat == 0:  # Kick on first beat of each chord
-            drum_seed.notes.add(
-                pitch=36,            # Kick drum
-                velocity=100,
-                start_time=beat_time,
-                end_time=beat_time + 0.1,
-                is_drum=True
-            )
-        
-        # Snare on beat 2 (if it's in snare_beats)
-        if beat + 1 in snare_beats and beat == 1:  # Beat 2 of the pattern
-            drum_seed.notes.add(
-                pitch=38,            # Snare drum
-                velocity=100,
-                start_time=beat_time,
-                end_time=beat_time + 0.1,
-                is_drum=True
-            )
-        
-        # Hi-hat pattern with specified divisions
-        for div in range(hi_hat_divisions):
-            div_time = beat_time + (div * beat_s / hi_hat_divisions)
-            velocity = 80 if div == 0 else 60  # Accent on the beat
-            drum_seed.notes.add(
-                pitch=42,            # Closed hi-hat
-                velocity=velocity,
-                start_time=div_time,
-                end_time=div_time + 0.1,
-                is_drum=True
-            )
-    
-    # Get end times
-    seed_end = max(n.end_time for n in seed.notes)
-    drum_seed_end = max(n.end_time for n in drum_seed.notes)
-    
     # Create a shorter primer for bass generation (just the first chord)
     bass_primer = note_seq.NoteSequence()
     bass_primer.ticks_per_quarter = seed.ticks_per_quarter
@@ -348,9 +423,12 @@ def generate_arrangement_from_chords(
     bass_opts.args['temperature'].float_value = bass_complexity
     
     # Define generation options for drums
+    # With an empty primer the generator rejects a section starting at 0, so
+    # start one step in, as drums_rnn_generate does for an empty primer
+    drum_first_step = 60.0 / bpm / drum_rnn.steps_per_quarter
     drum_opts = generator_pb2.GeneratorOptions()
     drum_opts.generate_sections.add(
-        start_time=drum_seed_end,
+        start_time=drum_first_step,
         end_time=total_duration
     )
     drum_opts.args['temperature'].float_value = drum_complexity
@@ -371,32 +449,29 @@ def generate_arrangement_from_chords(
     single_loop.tempos.extend(seed.tempos)
     single_loop.time_signatures.extend(seed.time_signatures)
     
-    # Add chord roots as bass notes (already in correct range)
+    # Tag bass/drum channels on the source notes so each group can be
+    # appended in one bulk protobuf copy instead of a CopyFrom per note
     for n in seed.notes:
-        new_note = single_loop.notes.add()
-        new_note.CopyFrom(n)
-        new_note.instrument = 0      # Bass channel
-        new_note.program = 33        # Electric Bass (finger)
-        new_note.is_drum = False
-    
-    # Add AI-generated bass notes (already improved)
+        n.instrument = 0      # Bass channel
+        n.program = 33        # Electric Bass (finger)
+        n.is_drum = False
     for n in bass_seq.notes:
-        # Skip primer notes that we already added from the seed
-        if n.start_time < chord_duration:
-            continue
-        
-        new_note = single_loop.notes.add()
-        new_note.CopyFrom(n)
-        new_note.instrument = 0      # Bass channel
-        new_note.program = 33        # Electric Bass (finger)
-        new_note.is_drum = False
+        n.instrument = 0
+        n.program = 33
+        n.is_drum = False
+    for n in drum_seq.notes:
+        n.instrument = 9      # Drum channel (GM standard)
+        n.is_drum = True
+    
+    # Add chord roots as bass notes (already in correct range)
+    single_loop.notes.MergeFrom(seed.notes)
+    
+    # Add AI-generated bass notes (already improved), skipping primer notes
+    # that we already added from the seed
+    single_loop.notes.extend(n for n in bass_seq.notes if n.start_time >= chord_duration)
     
     # Add drum notes
-    for n in drum_seq.notes:
-        new_note = single_loop.notes.add()
-        new_note.CopyFrom(n)
-        new_note.instrument = 9  # Drum channel (GM standard)
-        new_note.is_drum = True
+    single_loop.notes.MergeFrom(drum_seq.notes)
     
     # Set single loop duration
     single_loop.total_time = max(n.end_time for n in single_loop.notes)
@@ -404,34 +479,23 @@ def generate_arrangement_from_chords(
     
     print(f"🔄 Creating {loop_count} seamless loops...")
     
-    # Create the final looped sequence
-    looped_sequence = note_seq.NoteSequence()
-    looped_sequence.ticks_per_quarter = single_loop.ticks_per_quarter
-    looped_sequence.tempos.extend(single_loop.tempos)
-    looped_sequence.time_signatures.extend(single_loop.time_signatures)
-    
-    # Copy the single loop multiple times
     for loop_index in range(loop_count):
-        time_offset = loop_index * original_duration
-        
-        print(f"  Loop {loop_index + 1}/{loop_count}: offset +{time_offset:.1f}s")
-        
-        # Copy all notes from single loop with time offset
-        for note in single_loop.notes:
-            new_note = looped_sequence.notes.add()
-            new_note.CopyFrom(note)
-            new_note.start_time += time_offset
-            new_note.end_time += time_offset
-    
-    # Set final total duration
-    looped_sequence.total_time = original_duration * loop_count
+        print(f"  Loop {loop_index + 1}/{loop_count}: offset +{loop_index * original_duration:.1f}s")
     
-    # Export looped sequence
-    note_seq.sequence_proto_to_midi_file(looped_sequence, output_file)
+    # Export looped arrangement directly from the single loop's notes
+    write_arrangement_midi(
+        single_loop.notes,
+        loop_count=loop_count,
+        loop_duration=original_duration,
+        bpm=bpm,
+        output_file=output_file,
+        ticks_per_quarter=single_loop.ticks_per_quarter
+    )
+    total_looped_duration = original_duration * loop_count
     
     print(f"✅ Generated enhanced looped arrangement saved to {output_file}")
     print(f"📊 Single loop: {original_duration:.1f}s")
-    print(f"📊 Total duration: {looped_sequence.total_time:.1f}s ({loop_count} loops)")
+    print(f"📊 Total duration: {total_looped_duration:.1f}s ({loop_count} loops)")
     print(f"🎸 Bass improvements applied - no out-of-range notes!")
     print(f"🎵 Perfect for seamless playback - no timing gaps!")
 
@@ -443,14 +507,13 @@ def generate_arrangement(chord_progression, bpm=100, bass_complexity=2, drum_com
     """
     Generate a full arrangement from a chord progression with enhanced bass.
     Returns Path to generated MIDI file (looped 8 times by default)
+    hi_hat_divisions and snare_beats are deprecated and ignored.
     """
-    from model_manager import get_models
-    
     print(f"Generating enhanced looped arrangement for: {' → '.join(chord_progression)}")
     print(f"Settings: BPM={bpm}, Bass={bass_complexity}, Drums={drum_complexity}, Loops={loop_count}")
     
     # Get pre-loaded models
-    bass_rnn, drum_rnn = get_models()
+    bass_rnn, drum_rnn = _wait_for_models()
     
     # Use enhanced generate_arrangement_from_chords function
     arrangement = generate_arrangement_from_chords(
@@ -458,8 +521,6 @@ def generate_arrangement(chord_progression, bpm=100, bass_complexity=2, drum_com
         bpm=bpm,
         bass_complexity=bass_complexity,
         drum_complexity=drum_complexity,
-        hi_hat_divisions=hi_hat_divisions,
-        snare_beats=snare_beats,
         output_file=output_file,
         bass_rnn=bass_rnn,
         drum_rnn=drum_rnn,
@@ -480,8 +541,8 @@ def test_enhanced_arrangement_generator():
     # Sample 8-chord progression (2-beat segments)
     test_chords = ['C', 'C', 'G', 'G', 'Am', 'Am', 'F', 'F']
     
-    # Initialize models once
-    bass_rnn, drum_rnn = MagentaModelManager.initialize_models()
+    # Get the shared models (initialized once per process)
+    bass_rnn, drum_rnn = _wait_for_models()
     
     # Generate enhanced looped arrangement
     arrangement = generate_arrangement_from_chords(
@@ -489,8 +550,6 @@ def test_enhanced_arrangement_generator():
         bpm=100,
         bass_complexity=2,
         drum_complexity=1,
-        hi_hat_divisions=4,
-        snare_beats=(2, 4),
         output_file='test_enhanced_arrangement_8x_looped.mid',
         bass_rnn=bass_rnn,
         drum_rnn=drum_rnn,
@@ -563,5 +622,9 @@ def get_user_complexity_settings():
     return bass_complexity, drum_complexity, bpm, loop_count
 
 if __name__ == "__main__":
+    # Start warming up the models while the user answers the
+    # input() prompts in get_user_complexity_settings
+    start_model_loading()
+    
     # Run enhanced test
     test_enhanced_arrangement_generator()
\ No newline at end of file
@@ -1,198 +1,324 @@
 # chord_analyzer_adapted.py - Chord analysis with stretching for recorded MIDI
 
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')  # Headless rendering - visualizations are only saved to PNG
+from matplotlib.collections import LineCollection
+import logging
 import os
 import time
-from collections import Counter, defaultdict
-
-# Chord definitions from original chord_analyzer.py
-CHORD_DEFINITIONS = {
-    # Major triads (root, major third, perfect fifth)
-    'C': [0, 4, 7], 'C#': [1, 5, 8], 'D': [2, 6, 9], 'D#': [3, 7, 10], 
-    'E': [4, 8, 11], 'F': [5, 9, 0], 'F#': [6, 10, 1], 'G': [7, 11, 2], 
-    'G#': [8, 0, 3], 'A': [9, 1, 4], 'A#': [10, 2, 5], 'B': [11, 3, 6],
-    
-    # Minor triads (root, minor third, perfect fifth)
-    'Cm': [0, 3, 7], 'C#m': [1, 4, 8], 'Dm': [2, 5, 9], 'D#m': [3, 6, 10], 
-    'Em': [4, 7, 11], 'Fm': [5, 8, 0], 'F#m': [6, 9, 1], 'Gm': [7, 10, 2], 
-    'G#m': [8, 11, 3], 'Am': [9, 0, 4], 'A#m': [10, 1, 5], 'Bm': [11, 2, 6],
-    
-    # Major 7th chords (for jazz contexts)
-    'Cmaj7': [0, 4, 7, 11], 'C#maj7': [1, 5, 8, 0], 'Dmaj7': [2, 6, 9, 1],
-    'D#maj7': [3, 7, 10, 2], 'Emaj7': [4, 8, 11, 3], 'Fmaj7': [5, 9, 0, 4],
-    'F#maj7': [6, 10, 1, 5], 'Gmaj7': [7, 11, 2, 6], 'G#maj7': [8, 0, 3, 7],
-    'Amaj7': [9, 1, 4, 8], 'A#maj7': [10, 2, 5, 9], 'Bmaj7': [11, 3, 6, 10],
-    
-    # Minor 7th chords
-    'Cm7': [0, 3, 7, 10], 'C#m7': [1, 4, 8, 11], 'Dm7': [2, 5, 9, 0], 
-    'D#m7': [3, 6, 10, 1], 'Em7': [4, 7, 11, 2], 'Fm7': [5, 8, 0, 3],
-    'F#m7': [6, 9, 1, 4], 'Gm7': [7, 10, 2, 5], 'G#m7': [8, 11, 3, 6],
-    'Am7': [9, 0, 4, 7], 'A#m7': [10, 1, 5, 8], 'Bm7': [11, 2, 6, 9],
-    
-    # Dominant 7th chords
-    'C7': [0, 4, 7, 10], 'C#7': [1, 5, 8, 11], 'D7': [2, 6, 9, 0],
-    'D#7': [3, 7, 10, 1], 'E7': [4, 8, 11, 2], 'F7': [5, 9, 0, 3],
-    'F#7': [6, 10, 1, 4], 'G7': [7, 11, 2, 5], 'G#7': [8, 0, 3, 6],
-    'A7': [9, 1, 4, 7], 'A#7': [10, 2, 5, 8], 'B7': [11, 3, 6, 9]
-}
+import uuid
+from functools import lru_cache
 
-def identify_chord_with_confidence(note_group):
+from numba_compat import NUMBA_AVAILABLE, njit
+from viz_utils import ensure_output_dir, shared_figure
+
+logger = logging.getLogger(__name__)
+
+# Chord definitions from original chord_analyzer.py, generated from interval
+# patterns so every chord type covers all 12 roots
+ROOT_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+CHORD_INTERVALS = [
+    ('', [0, 4, 7]),          # Major triads (root, major third, perfect fifth)
+    ('m', [0, 3, 7]),         # Minor triads (root, minor third, perfect fifth)
+    ('maj7', [0, 4, 7, 11]),  # Major 7th chords (for jazz contexts)
+    ('m7', [0, 3, 7, 10]),    # Minor 7th chords
+    ('7', [0, 4, 7, 10]),     # Dominant 7th chords
+]
+
+CHORD_DEFINITIONS = {}
+for suffix, intervals in CHORD_INTERVALS:
+    for root, root_name in enumerate(ROOT_NAMES):
+        CHORD_DEFINITIONS[root_name + suffix] = [(root + interval) % 12 for interval in intervals]
+
+# Chord templates precomputed as 12-bit pitch-class bitmasks (bit n = pitch class n)
+CHORD_NAMES = list(CHORD_DEFINITIONS)
+CHORD_INDEX = {name: i for i, name in enumerate(CHORD_NAMES)}
+CHORD_MASKS = np.array([sum(1 << pc for pc in pcs) for pcs in CHORD_DEFINITIONS.values()], dtype=np.uint16)
+CHORD_ROOTS = np.array([pcs[0] for pcs in CHORD_DEFINITIONS.values()], dtype=np.uint8)
+SIMPLE_CHORD_FLAGS = np.array([len(name) <= 2 for name in CHORD_NAMES])
+
+def _classify_chord(chord):
+    """Color class of a chord name for the progression timeline."""
+    if chord.endswith('m') and not chord.endswith('maj'):
+        return 'minor'
+    elif '7' in chord and not 'maj' in chord:
+        return 'dominant'
+    elif any(ext in chord for ext in ['maj', 'M']):
+        return 'major'
+    else:
+        return 'major' if not chord.endswith('m') else 'minor'
+
+def _chord_key(chord):
+    """Key implied by a (most common) chord name."""
+    if chord.endswith('m'):
+        return chord
+    return chord.replace('7', '').replace('maj', '')
+
+# Per-chord name lookups, so the viz and key paths skip string scans
+CHORD_COLOR = {name: _classify_chord(name) for name in CHORD_NAMES}
+CHORD_KEY = [_chord_key(name) for name in CHORD_NAMES]
+
+# Number of set bits for every 12-bit mask
+POPCOUNT = np.array([bin(i).count('1') for i in range(4096)], dtype=np.int8)
+CHORD_SIZES = POPCOUNT[CHORD_MASKS]
+
+# Columnar note table (one contiguous allocation instead of a dict per note)
+NOTE_DTYPE = np.dtype([
+    ('pitch', np.int16),
+    ('pc', np.uint8),
+    ('velocity', np.int16),
+    ('start', np.float64),
+    ('end', np.float64),
+])
+
+def _score_chord_batch(pc_masks, bass_pcs, non_chord_penalty=0.3, triad_bonus=0.0):
     """
-    Enhanced chord identification that returns a confidence score.
-    Adapted to work with melody_analyzer2 note format.
+    Score all chords for several (pitch-class bitmask, bass pitch class) inputs
+    in one vectorized pass. Returns a list of (best_chord, confidence).
+    
+    Args:
+        non_chord_penalty: Penalty per present pitch class outside the chord
+        triad_bonus: Stability bonus for plain triads over 7th chords
     """
-    if not note_group:
-        return None, 0
+    pc_masks = np.asarray(pc_masks, dtype=np.uint16)[:, None]
+    bass_pcs = np.asarray(bass_pcs, dtype=np.uint16)[:, None]
     
-    # Extract pitch classes from notes (melody_analyzer2 format)
-    all_pitches = [note['pitch'] for note in note_group]
-    pitch_classes = sorted(set(pitch % 12 for pitch in all_pitches))
+    # Chord tones present, and non-chord tones (penalized)
+    matched = POPCOUNT[CHORD_MASKS & pc_masks]
+    non_chord = POPCOUNT[pc_masks & ~CHORD_MASKS & 0xFFF]
     
-    # Get bass note
-    sorted_notes = sorted(note_group, key=lambda x: x['pitch'])
-    bass_pc = sorted_notes[0]['pitch'] % 12
+    # Bass note bonus/penalty: root in bass, chord tone in bass, non-chord tone in bass
+    bass_bonus = np.where(CHORD_ROOTS == bass_pcs, 2.0,
+                          np.where((CHORD_MASKS >> bass_pcs) & 1, 0.5, -1.0))
     
-    # Calculate scores for all possible chords
-    chord_scores = {}
+    # Complete triad bonus
+    scores = matched * 1.0 - non_chord * non_chord_penalty + bass_bonus + (matched >= 3) * 1.0
+    if triad_bonus:
+        scores = scores + (CHORD_SIZES == 3) * triad_bonus
     
-    for chord_name, chord_pcs in CHORD_DEFINITIONS.items():
-        score = 0
-        
-        # Check how many chord tones are present
-        matched_tones = set(pitch_classes).intersection(set(chord_pcs))
-        score += len(matched_tones) * 1.0
+    # Confidence is based on how much better the best chord is vs alternatives
+    max_scores = scores.max(axis=1)
+    second_scores = np.partition(scores, -2, axis=1)[:, -2]  # Gap between best and second-best
+    
+    results = []
+    for row_scores, max_score, second_score in zip(scores, max_scores, second_scores):
+        # Prefer simpler chords in case of ties
+        best_chords = np.flatnonzero(row_scores == max_score)
+        simple_chords = best_chords[SIMPLE_CHORD_FLAGS[best_chords]]
+        best_chord = CHORD_NAMES[simple_chords[0] if simple_chords.size else best_chords[0]]
+        results.append((best_chord, max(0, float(max_score - second_score))))
+    
+    return results
+
+# Template tables as int64 arrays for the compiled scoring loop
+_NJIT_CHORD_MASKS = CHORD_MASKS.astype(np.int64)
+_NJIT_CHORD_ROOTS = CHORD_ROOTS.astype(np.int64)
+_NJIT_CHORD_SIZES = CHORD_SIZES.astype(np.int64)
+
+@njit(cache=True)
+def _score_chords_njit(pc_mask, bass_pc, chord_masks, chord_roots, chord_sizes, simple_flags,
+                       non_chord_penalty, triad_bonus):
+    """
+    Compiled scalar version of _score_chord_batch for a single input, with the
+    same scoring and tie rules. Returns (best_chord_index, confidence).
+    """
+    best_idx = -1
+    best_simple = False
+    best_score = -np.inf
+    second_score = -np.inf
+    
+    for i in range(len(chord_masks)):
+        chord_mask = chord_masks[i]
         
-        # Penalize for non-chord tones
-        non_chord_tones = set(pitch_classes) - set(chord_pcs)
-        score -= len(non_chord_tones) * 0.3
+        matched = 0
+        non_chord = 0
+        for pc in range(12):
+            if (pc_mask >> pc) & 1:
+                if (chord_mask >> pc) & 1:
+                    matched += 1
+                else:
+                    non_chord += 1
         
-        # Bass note bonus/penalty
-        if bass_pc == chord_pcs[0]:  # Root in bass
-            score += 2.0
-        elif bass_pc in chord_pcs:  # Chord tone in bass
-            score += 0.5
-        else:  # Non-chord tone in bass
-            score -= 1.0
+        if chord_roots[i] == bass_pc:
+            bass_bonus = 2.0
+        elif (chord_mask >> bass_pc) & 1:
+            bass_bonus = 0.5
+        else:
+            bass_bonus = -1.0
         
-        # Complete triad bonus
-        if len(matched_tones) >= 3:
+        score = matched * 1.0 - non_chord * non_chord_penalty + bass_bonus
+        if matched >= 3:
             score += 1.0
-            
-        chord_scores[chord_name] = score
+        if triad_bonus != 0.0 and chord_sizes[i] == 3:
+            score += triad_bonus
+        
+        # Track best and second-best; ties keep the first simple chord
+        if score > best_score:
+            second_score = best_score
+            best_score = score
+            best_idx = i
+            best_simple = simple_flags[i]
+        elif score == best_score:
+            second_score = score
+            if simple_flags[i] and not best_simple:
+                best_idx = i
+                best_simple = True
+        elif score > second_score:
+            second_score = score
+    
+    return best_idx, best_score - second_score
+
+# Scoring weights (non_chord_penalty, triad_bonus): the standard scorer, and the
+# ROBUST scorer with a REDUCED non-chord penalty (less sensitive to artifacts)
+# plus a STABILITY BONUS preferring triads over 7th chords
+STANDARD_WEIGHTS = (0.3, 0.0)
+ROBUST_WEIGHTS = (0.2, 0.3)
+
+@lru_cache(maxsize=4096)
+def _score_chord(pc_mask, bass_pc, non_chord_penalty=0.3, triad_bonus=0.0):
+    """
+    Score all chords for a pitch-class bitmask and bass pitch class.
+    Cached, since songs keep revisiting the same few pitch-class sets.
+    """
+    if NUMBA_AVAILABLE:
+        best_idx, confidence = _score_chords_njit(
+            pc_mask, bass_pc, _NJIT_CHORD_MASKS, _NJIT_CHORD_ROOTS, _NJIT_CHORD_SIZES,
+            SIMPLE_CHORD_FLAGS, non_chord_penalty, triad_bonus
+        )
+        return CHORD_NAMES[best_idx], max(0, confidence)
+    
+    return _score_chord_batch([pc_mask], [bass_pc], non_chord_penalty, triad_bonus)[0]
+
+# Exact chord matches (pitch classes are exactly a chord's tones, bass on one
+# of them), scored once at import per weighting so clean MIDI skips scoring
+_EXACT_KEYS = [(int(mask), pc) for mask, pcs in zip(CHORD_MASKS, CHORD_DEFINITIONS.values()) for pc in pcs]
+
+# Sparse segments (single notes and dyads, 144 signatures) are just as common
+# in recorded melodies and take the same lookup fast path
+_EXACT_KEYS += [(mask, pc) for mask in range(1, 4096) if POPCOUNT[mask] <= 2
+                for pc in range(12) if (mask >> pc) & 1]
+
+EXACT_CHORDS = {
+    weights: dict(zip(_EXACT_KEYS, _score_chord_batch(*zip(*_EXACT_KEYS), *weights)))
+    for weights in (STANDARD_WEIGHTS, ROBUST_WEIGHTS)
+}
+
+def _score_signature(pc_mask, bass_pc, weights=STANDARD_WEIGHTS):
+    """Best chord and confidence for a (pitch-class bitmask, bass) signature."""
+    exact_match = EXACT_CHORDS[weights].get((pc_mask, bass_pc))
+    if exact_match is not None:
+        return exact_match
     
-    # Find the best chord and confidence
-    if not chord_scores:
-        return None, 0
+    return _score_chord(pc_mask, bass_pc, *weights)
+
+def _note_signature(note_group):
+    """Pitch-class bitmask and bass pitch class of a non-empty note group."""
+    # melody_analyzer2 format, pitch_class precomputed
+    pc_mask = 0
+    for note in note_group:
+        pc_mask |= 1 << note['pitch_class']
     
-    max_score = max(chord_scores.values())
-    best_chords = [name for name, score in chord_scores.items() if score == max_score]
+    # Get bass note
+    bass_pc = min(note['pitch'] for note in note_group) % 12
     
-    # Confidence is based on how much better the best chord is vs alternatives
-    sorted_scores = sorted(chord_scores.values(), reverse=True)
-    if len(sorted_scores) > 1:
-        confidence = max_score - sorted_scores[1]  # Gap between best and second-best
-    else:
-        confidence = max_score
+    return pc_mask, bass_pc
+
+def _column_signature(pitches):
+    """Pitch-class bitmask and bass pitch class of a non-empty pitch column."""
+    pitches = pitches.astype(np.int64)
     
-    # Prefer simpler chords in case of ties
-    if len(best_chords) > 1:
-        simple_chords = [c for c in best_chords if len(c) <= 2]
-        best_chord = simple_chords[0] if simple_chords else best_chords[0]
-    else:
-        best_chord = best_chords[0] if best_chords else None
+    # Bass is the lowest pitch; among equal lowest pitches, picking the longest
+    # note (as a sort on (pitch, -duration) would) cannot change its pitch class
+    bass_pc = int(pitches[np.argmin(pitches)]) % 12
     
-    return best_chord, max(0, confidence)
+    return pitch_class_mask(pitches % 12), bass_pc
 
-def apply_stretching_to_chord_analysis(notes):
+def _identify_chord(note_group, weights=STANDARD_WEIGHTS):
     """
-    Apply the same stretching logic as force_exactly_8_chords_analysis to chord analysis.
+    Shared chord identification for melody_analyzer2-format note groups.
+    Bass is the lowest pitch (ties on pitch by duration cannot change its pitch class).
     """
-    if not notes:
-        return notes
+    if not note_group:
+        return None, 0
     
-    # Find actual musical content span (same logic as force_exactly_8_chords_analysis)
-    music_start = min(note['start'] for note in notes)
-    music_end = max(note['end'] for note in notes)
-    actual_duration = music_end - music_start
+    return _score_signature(*_note_signature(note_group), weights)
+
+def identify_chord_with_confidence(note_group):
+    """
+    Enhanced chord identification that returns a confidence score.
+    Adapted to work with melody_analyzer2 note format.
+    """
+    return _identify_chord(note_group)
+
+def normalize_note_timing(notes, starts, ends, offset, stretch_factor=1.0):
+    """
+    Shift notes so offset maps to beat 0 and scale them by stretch_factor, as one
+    array expression over all notes. Note dicts are updated in place.
     
-    print(f"🎵 Chord analysis - Original content span: {music_start:.2f} → {music_end:.2f} beats ({actual_duration:.2f} beats)")
+    Args:
+        starts, ends: Current note timing as NumPy arrays (same order as notes)
     
-    # Apply stretching if content is substantial (same logic as force_exactly_8_chords_analysis)
-    if actual_duration > 4.0:  # Only stretch if we have substantial content
-        print(f"🎯 Chord analysis - Stretching timing from {actual_duration:.1f} beats to 16.0 beats...")
-        
-        # Calculate stretch factor (same as force_exactly_8_chords_analysis)
-        target_duration = 16.0  # 16 beats
-        stretch_factor = target_duration / actual_duration
-        stretch_factor *= 1  # Apply the same correction factor
-        
-        offset = music_start
-        
-        # Normalize and stretch all note timings
-        for note in notes:
-            note['start'] = (note['start'] - offset) * stretch_factor
-            note['end'] = (note['end'] - offset) * stretch_factor
-        
-        print(f"✅ Chord analysis - Timing stretched by factor {stretch_factor:.2f}x")
-    else:
-        print(f"⚠️  Chord analysis - Too little content ({actual_duration:.1f} beats). Using original timing.")
-        # Still normalize to start at 0
-        offset = music_start
-        for note in notes:
-            note['start'] = note['start'] - offset
-            note['end'] = note['end'] - offset
+    Returns:
+        starts, ends: Normalized note timing as NumPy arrays
+    """
+    starts = (starts - offset) * stretch_factor
+    ends = (ends - offset) * stretch_factor
     
-    return notes
+    for note, start, end in zip(notes, starts.tolist(), ends.tolist()):
+        note['start'] = start
+        note['end'] = end
+    
+    return starts, ends
 
-def group_notes_by_beats_with_tolerance(notes, tolerance_beats=0.15):
+def notes_to_columns(notes):
     """
-    Group notes by beats with timing tolerance for anticipatory playing.
-    Uses stretched note timing.
+    Convert melody_analyzer2 note dicts into a columnar NumPy table (NOTE_DTYPE).
+    Pitch classes are computed once here for all downstream chord scoring.
     """
-    beat_notes = defaultdict(list)
-    early_notes = defaultdict(list)
-    max_beat = 0
-    
-    for note in notes:
-        # Use stretched timing (already applied)
-        precise_start = note['start']
-        precise_end = note['end']
-        
-        beat_start = int(precise_start)
-        beat_end = int(precise_end)
-        
-        # Check if note starts close to the next beat boundary
-        fractional_part = precise_start - beat_start
-        is_anticipatory = fractional_part >= (1.0 - tolerance_beats)
-        
-        # Add note to all beats it spans
-        for beat in range(beat_start, beat_end + 1):
-            beat_notes[beat].append(note)
-            max_beat = max(max_beat, beat)
-        
-        # If note is anticipatory, also consider it for the next beat
-        if is_anticipatory and beat_start + 1 <= beat_end + 1:
-            next_beat = beat_start + 1
-            early_notes[next_beat].append(note)
-            max_beat = max(max_beat, next_beat)
-    
-    return beat_notes, early_notes, max_beat
+    columns = np.empty(len(notes), dtype=NOTE_DTYPE)
+    columns['pitch'] = [note['pitch'] for note in notes]
+    columns['pc'] = columns['pitch'] % 12
+    columns['velocity'] = [note.get('velocity', 0) for note in notes]
+    columns['start'] = [note['start'] for note in notes]
+    columns['end'] = [note['end'] for note in notes]
+    return columns
 
-def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, tolerance_beats=0.15):
+def warm_up():
+    """Compile the JIT kernels now (e.g. at server startup) instead of on the first analysis."""
+    if not NUMBA_AVAILABLE:
+        return
+    _score_chord.__wrapped__(0b10010001, 0, *STANDARD_WEIGHTS)
+
+def pitch_class_mask(pcs):
+    """12-bit pitch-class bitmask of a pitch-class column (e.g. columns['pc'][idx])."""
+    if not len(pcs):
+        return 0
+    return int(np.bitwise_or.reduce(np.left_shift(1, pcs.astype(np.int64))))
+
+def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, tolerance_beats=0.15,
+                                              visualize=False, midi_data=None):
     """
     ROBUST FIX: Add timing tolerance and note filtering to prevent chord misdetection
+    Per-step progress is logged at DEBUG level (per-segment note details are
+    only built when DEBUG is enabled); the result is logged at INFO.
+    The piano-roll PNG is only rendered when visualize is True; its filename is
+    returned as 'visualization_file' (None otherwise).
+    midi_data is an already-parsed miditoolkit.MidiFile of midi_file_path
+    (parsed here if None).
     """
-    print(f"🎼 Analyzing chord progression: {midi_file_path}")
-    print(f"🎯 Using ROBUST timing + chord detection")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    
+    logger.info(f"🎼 Analyzing chord progression: {midi_file_path}")
+    logger.debug("🎯 Using ROBUST timing + chord detection")
     
     # STEP 1: Extract timing (same as before)
     from melody_analyzer2 import extract_melody_with_timing
     
-    notes, ticks_per_beat = extract_melody_with_timing(midi_file_path, tolerance_beats=0.2)
+    notes, ticks_per_beat = extract_melody_with_timing(midi_file_path, tolerance_beats=0.2, midi_data=midi_data)
     
     if not notes:
-        print("❌ No notes found in MIDI file")
+        logger.warning("❌ No notes found in MIDI file")
         return {
             'analysis_type': 'chord_progression',
             'chord_progression': ['C'] * 8,
@@ -202,112 +328,124 @@ def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, to
             'tolerance_used': False
         }
     
-    print(f"📊 Extracted {len(notes)} notes from MIDI")
+    logger.debug(f"📊 Extracted {len(notes)} notes from MIDI")
     
     # STEP 2: Apply timing normalization (same as before)
-    if notes:
-        music_start = min(note['start'] for note in notes)
-        music_end = max(note['end'] for note in notes)
-        actual_duration = music_end - music_start
+    # Columnar note table (NOTE_DTYPE) built once; span, stretching, segment
+    # membership and scoring all run on its columns
+    columns = notes_to_columns(notes)
+    starts = columns['start']
+    ends = columns['end']
+    
+    music_start = starts.min()
+    music_end = ends.max()
+    actual_duration = music_end - music_start
+    
+    logger.debug(f"🎵 Actual musical content: {music_start:.2f} → {music_end:.2f} beats ({actual_duration:.2f} beats)")
+    
+    if actual_duration > 4.0:
+        logger.debug(f"🎯 Stretching timing from {actual_duration:.1f} beats to 16.0 beats...")
         
-        print(f"🎵 Actual musical content: {music_start:.2f} → {music_end:.2f} beats ({actual_duration:.2f} beats)")
+        stretch_factor = 16.0 / actual_duration
+        stretch_factor *= 0.98
+        offset = music_start
         
-        if actual_duration > 4.0:
-            print(f"🎯 Stretching timing from {actual_duration:.1f} beats to 16.0 beats...")
-            
-            stretch_factor = 16.0 / actual_duration
-            stretch_factor *= 0.98
-            offset = music_start
-            
-            for note in notes:
-                note['start'] = (note['start'] - offset) * stretch_factor
-                note['end'] = (note['end'] - offset) * stretch_factor
-            
-            print(f"✅ Timing stretched by factor {stretch_factor:.2f}x")
-        else:
-            print(f"⚠️  Too little content ({actual_duration:.1f} beats). Using default timing.")
-            offset = music_start
-            for note in notes:
-                note['start'] = note['start'] - offset
-                note['end'] = note['end'] - offset
+        starts, ends = normalize_note_timing(notes, starts, ends, offset, stretch_factor)
+        
+        logger.debug(f"✅ Timing stretched by factor {stretch_factor:.2f}x")
+    else:
+        logger.warning(f"⚠️  Too little content ({actual_duration:.1f} beats). Using default timing.")
+        offset = music_start
+        starts, ends = normalize_note_timing(notes, starts, ends, offset)
 
-    print(f"🎯 Final analysis timing: 0.00 → 16.00 beats")
+    logger.debug("🎯 Final analysis timing: 0.00 → 16.00 beats")
 
     # STEP 3: ROBUST segment creation with improved note filtering
     segment_duration = 2.0
     segments = []
     
-    print(f"🎯 Creating exactly 8 segments with ROBUST note filtering:")
+    logger.debug("🎯 Creating exactly 8 segments with ROBUST note filtering:")
+    
+    # ROBUST NOTE SELECTION: with notes ordered by start, only a window of
+    # notes found by binary search can touch each segment
+    segment_count = 8
+    segment_starts = np.arange(segment_count) * segment_duration
+    segment_ends = segment_starts + segment_duration
+    
+    # Per-note pitch, center and duration, computed once for all segments
+    pitches = columns['pitch']
+    centers = (starts + ends) / 2
+    # Keep notes that are at least 0.1 beats long (filter out very short artifacts)
+    long_enough = (ends - starts) >= 0.1
+    
+    # A note can only reach a segment if it starts within the longest note
+    # length of it (abs() keeps malformed end-before-start notes in range)
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    max_note_length = float(np.abs(ends - starts).max())
+    window_los = np.searchsorted(sorted_starts, segment_starts - max_note_length, side='left')
+    window_his = np.searchsorted(sorted_starts, segment_ends + max_note_length, side='right')
 
-    for seg_idx in range(8):
+    for seg_idx in range(segment_count):
         segment_start = seg_idx * segment_duration
         segment_end = (seg_idx + 1) * segment_duration
         segment_center = (segment_start + segment_end) / 2
         
-        print(f"  Segment {seg_idx+1}: {segment_start:.1f} → {segment_end:.1f} beats")
+        logger.debug(f"  Segment {seg_idx+1}: {segment_start:.1f} → {segment_end:.1f} beats")
 
-        # ROBUST NOTE SELECTION: Use multiple criteria
-        segment_notes = []
-        primary_notes = []
-        secondary_notes = []
+        # Candidate notes, back in original note order
+        window = np.sort(order[window_los[seg_idx]:window_his[seg_idx]])
+        window_centers = centers[window]
         
-        for note in notes:
-            note_start = note['start']
-            note_end = note['end']
-            note_center = (note_start + note_end) / 2
-            
-            # Primary notes: center falls within segment
-            if segment_start <= note_center <= segment_end:
-                primary_notes.append(note)
-            
-            # Secondary notes: any overlap with segment (but not center-based)
-            elif (note_start < segment_end and note_end > segment_start):
-                secondary_notes.append(note)
+        # Primary notes: center falls within segment
+        is_primary = (segment_start <= window_centers) & (window_centers <= segment_end)
+        # Secondary notes: any overlap with segment (but not center-based)
+        is_secondary = ~is_primary & (starts[window] < segment_end) & (ends[window] > segment_start)
+        
+        primary_idx = window[is_primary]
+        secondary_idx = window[is_secondary]
         
         # ROBUST SELECTION LOGIC:
-        if primary_notes:
+        if primary_idx.size:
             # Use notes whose center falls in the segment (most reliable)
-            segment_notes = primary_notes
+            segment_idx = primary_idx
             selection_method = "primary (center-based)"
-        elif secondary_notes:
+        elif secondary_idx.size:
             # Fallback to overlap-based selection
-            segment_notes = secondary_notes
+            segment_idx = secondary_idx
             selection_method = "secondary (overlap-based)"
         else:
             # No notes found
-            segment_notes = []
+            segment_idx = primary_idx
             selection_method = "none"
         
         # ADDITIONAL FILTERING: Remove notes that are too short (likely artifacts)
-        if segment_notes:
-            filtered_notes = []
-            for note in segment_notes:
-                note_duration = note['end'] - note['start']
-                # Keep notes that are at least 0.1 beats long (filter out very short artifacts)
-                if note_duration >= 0.1:
-                    filtered_notes.append(note)
-            
-            if filtered_notes:
-                segment_notes = filtered_notes
-            # If all notes were filtered out, keep original (better than nothing)
+        filtered_idx = segment_idx[long_enough[segment_idx]]
+        if filtered_idx.size:
+            segment_idx = filtered_idx
+        # If all notes were filtered out, keep original (better than nothing)
+        
+        segment_notes = [notes[i] for i in segment_idx]
 
         if segment_notes:
             # ROBUST CHORD DETECTION with additional debugging
-            chord, confidence = identify_chord_with_confidence_robust(segment_notes)
+            # (scored straight from the pitch column, same as identify_chord_with_confidence_robust)
+            chord, confidence = _score_signature(*_column_signature(pitches[segment_idx]), ROBUST_WEIGHTS)
             
             if chord is None:
                 chord = segments[-1]['chord'] if segments else 'C'
                 confidence = 0
             
             # Debug output with selection method
-            pcs = sorted(set(note['pitch'] % 12 for note in segment_notes))
-            note_details = [(note['pitch'], note['start'], note['end']) for note in segment_notes]
-            print(f"    {len(segment_notes)} notes ({selection_method}), PCs: {pcs}")
-            print(f"    Note details: {note_details}")
-            print(f"    → Chord: {chord} (confidence: {confidence:.2f})")
+            if debug:
+                pcs = sorted(set(note['pitch_class'] for note in segment_notes))
+                note_details = [(note['pitch'], note['start'], note['end']) for note in segment_notes]
+                logger.debug(f"    {len(segment_notes)} notes ({selection_method}), PCs: {pcs}")
+                logger.debug(f"    Note details: {note_details}")
+                logger.debug(f"    → Chord: {chord} (confidence: {confidence:.2f})")
             
         else:
-            print(f"    No notes - using previous chord or C")
+            logger.debug("    No notes - using previous chord or C")
             chord = segments[-1]['chord'] if segments else 'C'
             confidence = 0
         
@@ -316,6 +454,7 @@ def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, to
             'start_beat': segment_start,
             'end_beat': segment_end,
             'chord': chord,
+            'chord_id': CHORD_INDEX[chord],
             'confidence': confidence,
             'used_timing_tolerance': False,
             'segment_idx': seg_idx,
@@ -331,23 +470,19 @@ def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, to
         chord_progression.append(chord_progression[-1] if chord_progression else 'C')
     chord_progression = chord_progression[:8]
     
-    # Key detection
-    chord_counter = Counter(chord_progression)
-    most_common_chord = chord_counter.most_common(1)[0][0] if chord_counter else 'C'
+    # Key detection: histogram over integer chord IDs (ties go to the chord heard first)
+    chord_ids = np.array([CHORD_INDEX[chord] for chord in chord_progression], dtype=np.int64)
+    chord_hist = np.bincount(chord_ids, minlength=len(CHORD_NAMES))
+    detected_key = CHORD_KEY[chord_ids[np.argmax(chord_hist[chord_ids] == chord_hist.max())]]
     
-    if most_common_chord.endswith('m'):
-        detected_key = most_common_chord
-    else:
-        detected_key = most_common_chord.replace('7', '').replace('maj', '')
-    
-    # Generate visualization
-    create_chord_progression_visualization(
-        notes, segments, [], midi_file_path
-    )
+    # Generate visualization (optional - rendering dominates runtime on short files)
+    viz_filename = None
+    if visualize:
+        viz_filename = create_chord_progression_visualization(
+            notes, segments, [], midi_file_path
+        )
     
-    print(f"\n🎵 ROBUST 8-chord analysis results:")
-    print(f"  Progression: {' → '.join(chord_progression)}")
-    print(f"🎼 Detected key: {detected_key}")
+    logger.info(f"🎵 ROBUST 8-chord analysis: {' → '.join(chord_progression)} (key: {detected_key})")
     
     return {
         'analysis_type': 'chord_progression',
@@ -356,105 +491,37 @@ def analyze_chord_progression_with_stretching(midi_file_path, segment_size=2, to
         'key': detected_key,
         'timing_adjustments': [],
         'tolerance_used': False,
-        'stretched_notes': notes
+        'stretched_notes': notes,
+        'visualization_file': viz_filename
     }
 
 def identify_chord_with_confidence_robust(note_group):
     """
     ROBUST chord identification with better handling of timing artifacts
     """
-    if not note_group:
-        return None, 0
-    
-    # Extract pitch classes from notes
-    all_pitches = [note['pitch'] for note in note_group]
-    pitch_classes = sorted(set(pitch % 12 for pitch in all_pitches))
-    
-    # ROBUST BASS NOTE DETECTION: Use the note with longest duration + lowest pitch
-    # This prevents short artifacts from becoming the "bass" note
-    bass_candidates = []
-    for note in note_group:
-        duration = note['end'] - note['start']
-        bass_candidates.append((note['pitch'], duration, note))
-    
-    # Sort by pitch (lowest first), then by duration (longest first)
-    bass_candidates.sort(key=lambda x: (x[0], -x[1]))
-    bass_pc = bass_candidates[0][0] % 12
-    
-    # Calculate scores for all possible chords
-    chord_scores = {}
-    
-    for chord_name, chord_pcs in CHORD_DEFINITIONS.items():
-        score = 0
-        
-        # Check how many chord tones are present
-        matched_tones = set(pitch_classes).intersection(set(chord_pcs))
-        score += len(matched_tones) * 1.0
-        
-        # REDUCED penalty for non-chord tones (less sensitive to artifacts)
-        non_chord_tones = set(pitch_classes) - set(chord_pcs)
-        score -= len(non_chord_tones) * 0.2  # Reduced from 0.3
-        
-        # Bass note bonus/penalty (same as before)
-        if bass_pc == chord_pcs[0]:  # Root in bass
-            score += 2.0
-        elif bass_pc in chord_pcs:  # Chord tone in bass
-            score += 0.5
-        else:  # Non-chord tone in bass
-            score -= 1.0
-        
-        # Complete triad bonus
-        if len(matched_tones) >= 3:
-            score += 1.0
-        
-        # STABILITY BONUS: Prefer simpler chords (triads over 7th chords)
-        if len(chord_pcs) == 3:  # Triad
-            score += 0.3
-            
-        chord_scores[chord_name] = score
-    
-    # Find the best chord and confidence
-    if not chord_scores:
-        return None, 0
-    
-    max_score = max(chord_scores.values())
-    best_chords = [name for name, score in chord_scores.items() if score == max_score]
-    
-    # Confidence calculation
-    sorted_scores = sorted(chord_scores.values(), reverse=True)
-    if len(sorted_scores) > 1:
-        confidence = max_score - sorted_scores[1]
-    else:
-        confidence = max_score
-    
-    # Prefer simpler chords in case of ties
-    if len(best_chords) > 1:
-        simple_chords = [c for c in best_chords if len(c) <= 2]
-        best_chord = simple_chords[0] if simple_chords else best_chords[0]
-    else:
-        best_chord = best_chords[0] if best_chords else None
-    
-    return best_chord, max(0, confidence)
-
+    return _identify_chord(note_group, ROBUST_WEIGHTS)
 
 def identify_chord_with_early_notes(regular_notes, early_notes=None):
     """
     Identify chord considering both regular notes and potentially early notes.
     """
-    # First, try with just regular notes
-    if regular_notes:
+    if not early_notes:
         regular_chord, regular_confidence = identify_chord_with_confidence(regular_notes)
+        return regular_chord, regular_confidence, False  # False = didn't use early notes
+    
+    # Score regular notes and regular + early notes together in one batch
+    combined_notes = regular_notes + early_notes
+    if regular_notes:
+        (regular_chord, regular_confidence), (combined_chord, combined_confidence) = _score_chord_batch(
+            *zip(_note_signature(regular_notes), _note_signature(combined_notes))
+        )
     else:
         regular_chord, regular_confidence = None, 0
+        combined_chord, combined_confidence = _score_chord(*_note_signature(combined_notes))
     
-    # If we have early notes, try including them
-    if early_notes:
-        combined_notes = regular_notes + early_notes
-        combined_chord, combined_confidence = identify_chord_with_confidence(combined_notes)
-        
-        # If including early notes gives a much better result, use it
-        if combined_confidence > regular_confidence + 0.1:  # Threshold for improvement (PLAY WITH THIS)
-            return combined_chord, combined_confidence, True  # True = used early notes
+    # If including early notes gives a much better result, use it
+    if combined_confidence > regular_confidence + 0.1:  # Threshold for improvement (PLAY WITH THIS)
+        return combined_chord, combined_confidence, True  # True = used early notes
     
     return regular_chord, regular_confidence, False  # False = didn't use early notes
 
@@ -463,103 +530,107 @@ def create_chord_progression_visualization(notes, segments, timing_adjustments,
     Create visualization for chord progression analysis with stretching.
     """
     output_dir = "generated_visualizations"
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_output_dir(output_dir)
     
-    # Create filename
-    timestamp = int(time.time())
+    # Create filename - unique per render, since /download serves it as immutable
+    timestamp = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
     base_name = os.path.splitext(os.path.basename(midi_file_path))[0]
     viz_filename = f"{base_name}_chord_progression_{timestamp}.png"
     viz_path = os.path.join(output_dir, viz_filename)
     
-    plt.figure(figsize=(16, 8))
-    
-    # Plot 1: Note timeline (piano roll style)
-    plt.subplot(2, 1, 1)
-    plt.title(f'Chord Progression Analysis - {base_name}\n(With Stretching & Timing Tolerance)', 
-              fontsize=16, fontweight='bold', pad=20)
-    
-    if notes:
-        for note in notes:
-            plt.plot([note['start'], note['end']], [note['pitch'], note['pitch']], 
-                    linewidth=3, alpha=0.7)
-            plt.plot(note['start'], note['pitch'], 'o', markersize=4, alpha=0.8)
-    
-    # Mark segments with chords
-    for segment in segments:
-        if segment['chord'] is not None:
-            start = segment['start_beat']
-            end = segment['end_beat'] + 1
+    with shared_figure((16, 8)) as fig:
+        note_ax, chord_ax = fig.subplots(2, 1)
+    
+        # Plot 1: Note timeline (piano roll style)
+        note_ax.set_title(f'Chord Progression Analysis - {base_name}\n(With Stretching & Timing Tolerance)', 
+                          fontsize=16, fontweight='bold', pad=20)
+    
+        if notes:
+            # One LineCollection + one scatter instead of two artists per note,
+            # keeping the per-note colors from the default color cycle
+            starts = np.array([note['start'] for note in notes])
+            ends = np.array([note['end'] for note in notes])
+            pitches = np.array([note['pitch'] for note in notes])
+            cycle = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+            colors = [cycle[i % len(cycle)] for i in range(len(notes))]
+        
+            note_lines = np.stack([np.column_stack([starts, pitches]), np.column_stack([ends, pitches])], axis=1)
+            note_ax.add_collection(LineCollection(note_lines, colors=colors, linewidths=3, alpha=0.7, rasterized=True))
+            note_ax.scatter(starts, pitches, s=16, c=colors, alpha=0.8, rasterized=True)
+            note_ax.autoscale_view()
+    
+        # Pitch extremes for label placement, computed once instead of per segment/beat
+        max_pitch = int(pitches.max()) if notes else 60
+        min_pitch = int(pitches.min()) if notes else 60
+    
+        # Mark segments with chords
+        for segment in segments:
+            if segment['chord'] is not None:
+                start = segment['start_beat']
+                end = segment['end_beat'] + 1
             
-            # Use different colors for timing-adjusted segments
-            color = 'lightblue' if segment['used_timing_tolerance'] else 'lightgreen'
-            plt.axvspan(start, end, alpha=0.3, color=color)
+                # Use different colors for timing-adjusted segments
+                color = 'lightblue' if segment['used_timing_tolerance'] else 'lightgreen'
+                note_ax.axvspan(start, end, alpha=0.3, color=color)
             
-            # Add chord labels
-            plt.text((start + end) / 2, max(note['pitch'] for note in notes) - 5, 
-                    segment['chord'], 
-                    horizontalalignment='center', fontsize=12, fontweight='bold')
-    
-    # Highlight beats where timing tolerance was used
-    for beat in timing_adjustments:
-        plt.axvline(x=beat, color='red', linestyle='--', alpha=0.7, linewidth=1)
-        plt.text(beat, min(note['pitch'] for note in notes) + 2, 'T', 
-                fontsize=10, ha='center', color='red', fontweight='bold')
-    
-    plt.ylabel('MIDI Pitch')
-    plt.xlabel('Time (normalized beats)')
-    plt.grid(True, alpha=0.3)
-    plt.xlim(0, 16)
-    
-    # Plot 2: Chord progression timeline
-    plt.subplot(2, 1, 2)
-    plt.title('Detected Chord Progression', fontsize=14, fontweight='bold')
-    
-    chord_colors = {'major': 'lightblue', 'minor': 'lightcoral', 'dominant': 'lightyellow', 'other': 'lightgray'}
-    
-    for i, segment in enumerate(segments):
-        chord = segment['chord']
-        if chord:
-            # Determine chord color
-            if chord.endswith('m') and not chord.endswith('maj'):
-                color = chord_colors['minor']
-            elif '7' in chord and not 'maj' in chord:
-                color = chord_colors['dominant']
-            elif any(ext in chord for ext in ['maj', 'M']):
-                color = chord_colors['major']
-            else:
-                color = chord_colors['major'] if not chord.endswith('m') else chord_colors['minor']
+                # Add chord labels
+                note_ax.text((start + end) / 2, max_pitch - 5, 
+                             segment['chord'], 
+                             horizontalalignment='center', fontsize=12, fontweight='bold')
+    
+        # Highlight beats where timing tolerance was used
+        for beat in timing_adjustments:
+            note_ax.axvline(x=beat, color='red', linestyle='--', alpha=0.7, linewidth=1)
+            note_ax.text(beat, min_pitch + 2, 'T', 
+                         fontsize=10, ha='center', color='red', fontweight='bold')
+    
+        note_ax.set_ylabel('MIDI Pitch')
+        note_ax.set_xlabel('Time (normalized beats)')
+        note_ax.grid(True, alpha=0.3)
+        note_ax.set_xlim(0, 16)
+    
+        # Plot 2: Chord progression timeline
+        chord_ax.set_title('Detected Chord Progression', fontsize=14, fontweight='bold')
+    
+        chord_colors = {'major': 'lightblue', 'minor': 'lightcoral', 'dominant': 'lightyellow', 'other': 'lightgray'}
+    
+        for i, segment in enumerate(segments):
+            chord = segment['chord']
+            if chord:
+                color = chord_colors[CHORD_COLOR[chord]]
             
-            plt.barh(0, 2, left=i*2, height=0.5, color=color, alpha=0.7, edgecolor='black')
-            plt.text(i*2 + 1, 0, chord, ha='center', va='center', fontweight='bold')
-    
-    plt.xlim(0, 16)
-    plt.ylim(-0.5, 0.5)
-    plt.ylabel('Chord')
-    plt.xlabel('Time (beats)')
-    plt.yticks([])
-    plt.grid(True, alpha=0.3, axis='x')
-    
-    # Add legend
-    legend_text = f"""Legend:
-    Green: Normal timing | Blue: Timing adjusted | Red dashed: Early notes detected
-    Chord progression: {' → '.join([s['chord'] for s in segments if s['chord']])}
-    Timing adjustments: {len(timing_adjustments)} beats"""
-    
-    plt.text(0.02, 0.02, legend_text, transform=plt.gca().transAxes, 
-             verticalalignment='bottom', fontsize=10,
-             bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
-    
-    plt.tight_layout()
-    plt.savefig(viz_path, dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print(f"📊 Chord progression visualization saved: {viz_path}")
+                chord_ax.barh(0, 2, left=i*2, height=0.5, color=color, alpha=0.7, edgecolor='black')
+                chord_ax.text(i*2 + 1, 0, chord, ha='center', va='center', fontweight='bold')
+    
+        chord_ax.set_xlim(0, 16)
+        chord_ax.set_ylim(-0.5, 0.5)
+        chord_ax.set_ylabel('Chord')
+        chord_ax.set_xlabel('Time (beats)')
+        chord_ax.set_yticks([])
+        chord_ax.grid(True, alpha=0.3, axis='x')
+    
+        # Add legend
+        legend_text = f"""Legend:
+        Green: Normal timing | Blue: Timing adjusted | Red dashed: Early notes detected
+        Chord progression: {' → '.join([s['chord'] for s in segments if s['chord']])}
+        Timing adjustments: {len(timing_adjustments)} beats"""
+    
+        chord_ax.text(0.02, 0.02, legend_text, transform=chord_ax.transAxes, 
+                      verticalalignment='bottom', fontsize=10,
+                      bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
+    
+        # All artists sit inside the axes, so tight_layout is enough and the
+        # second render pass of bbox_inches='tight' isn't needed
+        fig.tight_layout()
+        fig.savefig(viz_path, dpi=150)
+    
+    logger.info(f"📊 Chord progression visualization saved: {viz_path}")
     return viz_filename
 
 # Test function
 def test_chord_analysis(midi_file_path):
     """Test the adapted chord analysis"""
-    result = analyze_chord_progression_with_stretching(midi_file_path)
+    result = analyze_chord_progression_with_stretching(midi_file_path, visualize=True)
     print(f"\n🎵 Test Results:")
     print(f"   Key: {result['key']}")
     print(f"   Progression: {' → '.join(result['chord_progression'])}")
@@ -568,6 +639,9 @@ def test_chord_analysis(midi_file_path):
     return result
 
 if __name__ == "__main__":
+    # Show the per-segment analysis details on the console
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+    
     # Test with a MIDI file
     test_file = "midi_samples/test_chord.mid"
     test_chord_analysis(test_file)
\ No newline at end of file
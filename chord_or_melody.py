@@ -1,57 +1,216 @@
 # chord_or_melody.py - Enhanced with stretching and visualization for recorded MIDI
 
+import logging
+import mmap
 import mido
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from collections import defaultdict
 import os
+import struct
 
-def detect_midi_type_with_stretching_and_viz(midi_file, output_dir="generated_visualizations"):
+from viz_utils import ensure_output_dir, shared_figure
+
+logger = logging.getLogger(__name__)
+
+def _read_midi_bytes(midi_file):
+    """All bytes of a binary file-like object, from the start."""
+    midi_file.seek(0)
+    return midi_file.read()
+
+def _read_variable_int(data, pos):
+    """Read a MIDI variable-length quantity; returns (value, position after it)."""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos
+
+def _scan_note_ticks(data):
     """
-    Detect if MIDI is chord progression or melody, apply stretching like force_exactly_8_chords_analysis,
-    and generate a visualization showing the analysis result.
+    Walk the chunks of a Standard MIDI File held in a buffer, collecting note timing.
+    
+    Note-ons are paired with note-offs per track and (channel, note) in FIFO
+    order, like miditoolkit does when building notes; unmatched events are
+    dropped. Meta, sysex and other channel events are skipped over by length.
+    
+    Returns:
+        ticks_per_beat, starts, ends, pitches (absolute ticks / note numbers),
+        or None if the file has anything this scan doesn't handle
     """
-    try:
-        # Ensure output directory exists
-        os.makedirs(output_dir, exist_ok=True)
-        
-        print(f"🔍 Analyzing MIDI type with stretching: {midi_file}")
-        
-        # FIXED: Use the existing melody analyzer timing extraction
-        from melody_analyzer2 import extract_melody_with_timing
+    chunk_name, header_size, _, num_tracks, ticks_per_beat = struct.unpack_from('>4sLhhh', data, 0)
+    if chunk_name != b'MThd' or header_size < 6 or num_tracks <= 0 or ticks_per_beat <= 0:
+        return None
+    
+    starts, ends, pitches = [], [], []
+    pos = 8 + header_size
+    for _ in range(num_tracks):
+        chunk_name, track_size = struct.unpack_from('>4sL', data, pos)
+        pos += 8
+        track_end = pos + track_size
+        if chunk_name != b'MTrk' or track_size == 0 or track_end > len(data):
+            return None
         
-        # Extract notes using the same method as force_exactly_8_chords_analysis
-        notes, ticks_per_beat = extract_melody_with_timing(midi_file, tolerance_beats=0.2)
+        tick = 0
+        last_status = None
+        open_notes = {}  # (channel, note) -> note-on ticks, oldest first
+        while pos < track_end:
+            delta, pos = _read_variable_int(data, pos)
+            tick += delta
+            
+            status = data[pos]
+            if status < 0x80:
+                # Running status: this byte is already the first data byte
+                if last_status is None:
+                    return None
+                status = last_status
+            else:
+                pos += 1
+                if status != 0xff:
+                    # Meta events don't set running status
+                    last_status = status
+            
+            if status == 0xff:
+                length, pos = _read_variable_int(data, pos + 1)
+                pos += length
+            elif status == 0xf0 or status == 0xf7:
+                length, pos = _read_variable_int(data, pos)
+                pos += length
+            elif status >= 0xf0:
+                return None  # System common / realtime events inside a track
+            elif status & 0xe0 == 0xc0:
+                pos += 1  # Program change / channel pressure
+            else:
+                note, velocity = data[pos], data[pos + 1]
+                pos += 2
+                if note > 127 or velocity > 127:
+                    return None
+                kind = status & 0xf0
+                if kind == 0x90 and velocity > 0:
+                    open_notes.setdefault((status & 0x0f, note), []).append(tick)
+                elif kind == 0x80 or kind == 0x90:
+                    opened = open_notes.get((status & 0x0f, note))
+                    if opened:
+                        starts.append(opened.pop(0))
+                        ends.append(tick)
+                        pitches.append(note)
         
-        if not notes:
+        if pos != track_end:
+            return None
+    
+    return ticks_per_beat, np.array(starts), np.array(ends), np.array(pitches)
+
+def _quick_note_ticks(midi_file):
+    """
+    Onset fast path for classification: note timing straight from the file bytes.
+    
+    Scans an mmap of the file with struct.unpack_from instead of building the
+    full mido/miditoolkit object graph.
+    
+    Returns:
+        Same as _scan_note_ticks; None also when the file can't be scanned
+        (the caller then falls back to the full parser, which reports errors)
+    """
+    try:
+        if hasattr(midi_file, 'read'):
+            # In-memory upload: scan its bytes directly
+            return _scan_note_ticks(_read_midi_bytes(midi_file))
+        with open(midi_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _scan_note_ticks(data)
+    except (OSError, ValueError, IndexError, struct.error):
+        return None
+
+def _analyze_midi_type(midi_file, visualize=True, midi_data=None):
+    """
+    Extract notes, apply stretching and classify them (no rendering).
+    
+    Args:
+        visualize: Whether the caller will render; if not, note timing comes
+            from the quick onset scan when possible and no events are built
+        midi_data: Already-parsed miditoolkit.MidiFile of midi_file; when
+            given, notes are taken from it instead of re-reading the file
+    
+    Returns:
+        stretched_events, analysis_result (both None if the file has no notes;
+        stretched_events is also None when the quick scan was used)
+    """
+    print(f"🔍 Analyzing MIDI type with stretching: {midi_file}")
+    
+    scanned = None if visualize or midi_data is not None else _quick_note_ticks(midi_file)
+    if scanned is not None:
+        ticks_per_beat, start_ticks, end_ticks, pitches = scanned
+        if not len(pitches):
             print("❌ No notes found in MIDI file")
-            return "unknown", None
+            return None, None
         
-        print(f"🎵 Extracted {len(notes)} notes using melody_analyzer2")
+        print(f"🎵 Scanned {len(pitches)} notes from raw MIDI events")
         
-        # Apply stretching logic (same as force_exactly_8_chords_analysis)
-        stretched_events = apply_stretching_to_melody_notes(notes)
+        starts, _, _ = _stretch_note_timing(start_ticks / ticks_per_beat, end_ticks / ticks_per_beat)
+        analysis_result = analyze_polyphony_patterns(None, starts=starts, pitches=pitches, include_notes_by_time=False)
         
-        # Analyze the stretched events
-        analysis_result = analyze_polyphony_patterns(stretched_events)
+        print(f"🎵 Classification: {analysis_result['classification']}")
         
-        # Generate visualization
-        viz_filename = generate_chord_melody_visualization(
-            stretched_events, 
-            analysis_result, 
-            midi_file, 
-            output_dir
-        )
+        return None, analysis_result
+    
+    # FIXED: Use the existing melody analyzer timing extraction
+    from melody_analyzer2 import extract_melody_with_timing
+    
+    # Extract notes using the same method as force_exactly_8_chords_analysis
+    notes, ticks_per_beat = extract_melody_with_timing(midi_file, tolerance_beats=0.2, midi_data=midi_data)
+    
+    if not notes:
+        print("❌ No notes found in MIDI file")
+        return None, None
+    
+    print(f"🎵 Extracted {len(notes)} notes using melody_analyzer2")
+    
+    # Apply stretching logic (same as force_exactly_8_chords_analysis)
+    starts, ends, durations = _stretch_melody_note_timing(notes)
+    stretched_events = _melody_notes_to_events(notes, starts, ends, durations)
+    
+    # Analyze the stretched events, reusing the timing arrays
+    pitches = np.array([note['note'] for note in stretched_events])
+    analysis_result = analyze_polyphony_patterns(
+        stretched_events, starts=starts, pitches=pitches, include_notes_by_time=visualize
+    )
+    
+    print(f"🎵 Classification: {analysis_result['classification']}")
+    
+    return stretched_events, analysis_result
+
+def detect_midi_type_with_stretching_and_viz(midi_file, output_dir="generated_visualizations", visualize=True,
+                                             midi_data=None):
+    """
+    Detect if MIDI is chord progression or melody, apply stretching like force_exactly_8_chords_analysis,
+    and generate a visualization showing the analysis result.
+    With visualize=False only the classification is computed and viz_filename is None.
+    midi_data is an already-parsed miditoolkit.MidiFile of midi_file (optional).
+    """
+    try:
+        stretched_events, analysis_result = _analyze_midi_type(midi_file, visualize=visualize, midi_data=midi_data)
         
-        print(f"🎵 Classification: {analysis_result['classification']}")
+        if analysis_result is None:
+            return "unknown", None
+        
+        viz_filename = None
+        if visualize:
+            # Ensure output directory exists
+            ensure_output_dir(output_dir)
+            
+            # Generate visualization
+            viz_filename = generate_chord_melody_visualization(
+                stretched_events, 
+                analysis_result, 
+                midi_file, 
+                output_dir
+            )
         
         return analysis_result['classification'], viz_filename
         
     except Exception as e:
         print(f"❌ Error analyzing MIDI file: {e}")
-        import traceback
-        print(f"❌ Traceback: {traceback.format_exc()}")
+        # The traceback is only formatted if a handler actually emits the record
+        logger.exception("Analyze failed for %s", midi_file)
         return "error", None
 
 def apply_stretching_to_melody_notes(melody_notes):
@@ -61,20 +220,31 @@ def apply_stretching_to_melody_notes(melody_notes):
     if not melody_notes:
         return melody_notes
     
-    # Convert melody analyzer format to our analysis format
-    note_events = []
-    for note in melody_notes:
-        note_events.append({
-            'note': note.get('pitch', 60),  # MIDI note number
-            'start': note['start'],         # Already in beats
-            'end': note['end'],             # Already in beats  
-            'duration': note['end'] - note['start'],
-            'pitch_class': note.get('pitch_class', 0)
-        })
+    return _melody_notes_to_events(melody_notes, *_stretch_melody_note_timing(melody_notes))
+
+def _stretch_melody_note_timing(melody_notes):
+    """
+    Stretching for a non-empty melody analyzer note list, as array ops.
+    
+    Returns:
+        starts, ends, durations: Stretched timing arrays (same order as melody_notes)
+    """
+    # Timing columns for all notes, so the span and the stretching are array ops
+    starts = np.array([note['start'] for note in melody_notes])  # Already in beats
+    ends = np.array([note['end'] for note in melody_notes])      # Already in beats
     
+    return _stretch_note_timing(starts, ends)
+
+def _stretch_note_timing(starts, ends):
+    """
+    Stretch onset/offset arrays (in beats) to the 16-beat frame.
+    
+    Returns:
+        starts, ends, durations: Stretched timing arrays
+    """
     # Find actual musical content span (same logic as force_exactly_8_chords_analysis)
-    music_start = min(note['start'] for note in note_events)
-    music_end = max(note['end'] for note in note_events)
+    music_start = starts.min()
+    music_end = ends.max()
     actual_duration = music_end - music_start
     
     print(f"🎵 Original content span: {music_start:.2f} → {music_end:.2f} beats ({actual_duration:.2f} beats)")
@@ -91,28 +261,50 @@ def apply_stretching_to_melody_notes(melody_notes):
         offset = music_start
         
         # Normalize and stretch all note timings
-        for note in note_events:
-            note['start'] = (note['start'] - offset) * stretch_factor
-            note['end'] = (note['end'] - offset) * stretch_factor
-            note['duration'] = note['end'] - note['start']
+        event_starts = (starts - offset) * stretch_factor
+        event_ends = (ends - offset) * stretch_factor
+        durations = event_ends - event_starts
         
         print(f"✅ Timing stretched by factor {stretch_factor:.2f}x")
     else:
         print(f"⚠️  Too little content ({actual_duration:.1f} beats). Using original timing.")
         # Still normalize to start at 0
         offset = music_start
-        for note in note_events:
-            note['start'] = note['start'] - offset
-            note['end'] = note['end'] - offset
+        event_starts = starts - offset
+        event_ends = ends - offset
+        durations = ends - starts
     
-    return note_events
+    return event_starts, event_ends, durations
+
+def _melody_notes_to_events(melody_notes, starts, ends, durations):
+    """Convert melody analyzer notes plus stretched timing to our analysis format."""
+    return [
+        {
+            'note': note.get('pitch', 60),  # MIDI note number
+            'start': start,
+            'end': end,
+            'duration': duration,
+            'pitch_class': note.get('pitch_class', 0)
+        }
+        for note, start, end, duration in zip(
+            melody_notes, starts.tolist(), ends.tolist(), durations.tolist()
+        )
+    ]
 
-def analyze_polyphony_patterns(note_events):
+def analyze_polyphony_patterns(note_events, starts=None, pitches=None, include_notes_by_time=True):
     """
     Analyze polyphony patterns to determine if it's a chord progression or melody.
     Uses the stretched/normalized note events (in beats, not seconds).
+    
+    Args:
+        starts, pitches: Optional onset and MIDI note columns of note_events
+            already held by the caller (otherwise gathered from the dicts);
+            note_events may be None when both are given
+        include_notes_by_time: Build the per-time-point note lists (only the
+            visualization uses them); when False, 'notes_by_time' is omitted
     """
-    if not note_events:
+    note_count = len(note_events) if starts is None else len(starts)
+    if not note_count:
         return {
             'classification': 'unknown',
             'avg_polyphony': 0,
@@ -122,23 +314,22 @@ def analyze_polyphony_patterns(note_events):
         }
     
     # Group notes by time (with rounding to handle slight timing differences)
-    # Using smaller rounding for beats (0.25 beats = quarter note resolution)
-    notes_by_time = defaultdict(list)
-    
-    for note in note_events:
-        # Round to nearest 0.25 beats to group near-simultaneous notes
-        rounded_start = round(note['start'] * 4) / 4  # Quarter-beat resolution
-        notes_by_time[rounded_start].append(note['note'])
+    # Using smaller rounding for beats (0.25 beats = quarter note resolution).
+    # Onsets become integer quarter-beat indices, rounded for all notes at once
+    # (np.rint rounds half to even, like round())
+    if starts is None:
+        starts = np.fromiter((note['start'] for note in note_events), dtype=np.float64, count=note_count)
+    quarter_beats = np.rint(starts * 4).astype(np.int64)
     
-    # Calculate polyphony metrics
-    polyphony_counts = [len(notes) for _, notes in notes_by_time.items()]
+    # Calculate polyphony metrics (note count per distinct time point)
+    time_points, polyphony_counts = np.unique(quarter_beats, return_counts=True)
     total_time_points = len(polyphony_counts)
     
     if total_time_points > 0:
-        avg_polyphony = sum(polyphony_counts) / total_time_points
-        times_with_multiple_notes = sum(1 for count in polyphony_counts if count >= 2)
+        avg_polyphony = float(polyphony_counts.mean())
+        times_with_multiple_notes = int(np.count_nonzero(polyphony_counts >= 2))
         chord_ratio = times_with_multiple_notes / total_time_points
-        max_polyphony = max(polyphony_counts)
+        max_polyphony = int(polyphony_counts.max())
     else:
         avg_polyphony = 0
         chord_ratio = 0
@@ -158,111 +349,153 @@ def analyze_polyphony_patterns(note_events):
     print(f"   Percentage with multiple notes: {chord_ratio*100:.1f}%")
     print(f"   Times with multiple notes: {times_with_multiple_notes}")
     
-    return {
+    result = {
         'classification': classification,
         'avg_polyphony': avg_polyphony,
         'chord_ratio': chord_ratio,
         'max_polyphony': max_polyphony,
         'total_time_points': total_time_points,
-        'times_with_multiple_notes': times_with_multiple_notes,
-        'notes_by_time': dict(notes_by_time)  # For visualization
+        'times_with_multiple_notes': times_with_multiple_notes
     }
+    
+    if include_notes_by_time:
+        # Note numbers per time point (for visualization): a stable sort by time
+        # point keeps each group in note order
+        order = np.argsort(quarter_beats, kind='stable')
+        if pitches is None:
+            pitches = np.array([note['note'] for note in note_events])
+        sorted_notes = np.asarray(pitches)[order]
+        note_groups = np.split(sorted_notes, np.cumsum(polyphony_counts)[:-1])
+        notes_by_time = {
+            quarter_beat / 4: group.tolist()
+            for quarter_beat, group in zip(time_points.tolist(), note_groups)
+        }
+        result['notes_by_time'] = notes_by_time  # For visualization
+    
+    return result
 
-def generate_chord_melody_visualization(note_events, analysis_result, midi_file, output_dir):
+def generate_chord_melody_visualization(note_events, analysis_result, midi_file, output_dir, dpi=120):
     """
     Generate a visualization showing the analysis and classification result.
+    
+    Args:
+        dpi: Output resolution (120 gives ~1900 px wide PNGs, enough for web display)
     """
     import time
+    import uuid
     
-    # Create unique filename
-    timestamp = int(time.time())
+    # Create unique filename - /download serves it as immutable, so it must
+    # never be reused for different content
+    timestamp = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
     base_name = os.path.splitext(os.path.basename(midi_file))[0]
     viz_filename = f"{base_name}_chord_melody_analysis_{timestamp}.png"
     viz_path = os.path.join(output_dir, viz_filename)
     
     # Create the plot
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(16, 10))
-    
-    # Plot 1: Note timeline (piano roll style)
-    ax1.set_title(f'MIDI Analysis - {base_name}\nClassification: {analysis_result["classification"].upper()}', 
-                  fontsize=16, fontweight='bold', pad=20)
-    
-    if note_events:
-        for note in note_events:
-            ax1.plot([note['start'], note['end']], [note['note'], note['note']], 
-                    linewidth=3, alpha=0.7)
-            ax1.plot(note['start'], note['note'], 'o', markersize=4, alpha=0.8)
-    
-    ax1.set_ylabel('MIDI Note Number')
-    ax1.set_xlabel('Time (normalized beats)')
-    ax1.grid(True, alpha=0.3)
-    ax1.set_xlim(0, 16)  # Show full 16-beat span
-    
-    # Plot 2: Polyphony over time
-    notes_by_time = analysis_result.get('notes_by_time', {})
-    if notes_by_time:
-        times = sorted(notes_by_time.keys())
-        polyphony_values = [len(notes_by_time[t]) for t in times]
+    with shared_figure((16, 10)) as fig:
+        ax1, ax2, ax3 = fig.subplots(3, 1)
+    
+        # Plot 1: Note timeline (piano roll style)
+        ax1.set_title(f'MIDI Analysis - {base_name}\nClassification: {analysis_result["classification"].upper()}', 
+                      fontsize=16, fontweight='bold', pad=20)
+    
+        if note_events:
+            for note in note_events:
+                ax1.plot([note['start'], note['end']], [note['note'], note['note']], 
+                        linewidth=3, alpha=0.7)
+                ax1.plot(note['start'], note['note'], 'o', markersize=4, alpha=0.8)
+    
+        ax1.set_ylabel('MIDI Note Number')
+        ax1.set_xlabel('Time (normalized beats)')
+        ax1.grid(True, alpha=0.3)
+        ax1.set_xlim(0, 16)  # Show full 16-beat span
+    
+        # Plot 2: Polyphony over time
+        notes_by_time = analysis_result.get('notes_by_time', {})
+        if notes_by_time:
+            # Keys were inserted in ascending quarter-beat order, so no re-sort is needed
+            times = list(notes_by_time)
+            polyphony_values = [len(group) for group in notes_by_time.values()]
         
-        ax2.bar(times, polyphony_values, width=0.2, alpha=0.7, 
-               color='green' if analysis_result['classification'] == 'melody' else 'blue')
-        ax2.axhline(y=1.5, color='red', linestyle='--', alpha=0.7, label='Chord Threshold (1.5)')
-        ax2.set_ylabel('Simultaneous Notes')
-        ax2.set_xlabel('Time (normalized beats)')
-        ax2.set_title('Polyphony Analysis')
-        ax2.legend()
-        ax2.grid(True, alpha=0.3)
-        ax2.set_xlim(0, 16)
-    
-    # Plot 3: Analysis summary
-    ax3.axis('off')
-    
-    # Classification result box
-    classification = analysis_result['classification']
-    color = 'lightgreen' if classification == 'melody' else 'lightblue'
-    
-    result_text = f"""
-ANALYSIS RESULTS
+            ax2.bar(times, polyphony_values, width=0.2, alpha=0.7, 
+                   color='green' if analysis_result['classification'] == 'melody' else 'blue')
+            ax2.axhline(y=1.5, color='red', linestyle='--', alpha=0.7, label='Chord Threshold (1.5)')
+            ax2.set_ylabel('Simultaneous Notes')
+            ax2.set_xlabel('Time (normalized beats)')
+            ax2.set_title('Polyphony Analysis')
+            ax2.legend()
+            ax2.grid(True, alpha=0.3)
+            ax2.set_xlim(0, 16)
+    
+        # Plot 3: Analysis summary
+        ax3.axis('off')
+    
+        # Classification result box
+        classification = analysis_result['classification']
+        color = 'lightgreen' if classification == 'melody' else 'lightblue'
+    
+        result_text = f"""
+    ANALYSIS RESULTS
 
-Classification: {classification.upper()}
+    Classification: {classification.upper()}
 
-Key Metrics:
-• Average Polyphony: {analysis_result['avg_polyphony']:.2f}
-• Maximum Simultaneous Notes: {analysis_result['max_polyphony']}
-• Chord Ratio: {analysis_result['chord_ratio']*100:.1f}%
-• Total Time Points: {analysis_result['total_time_points']}
-• Times with Multiple Notes: {analysis_result['times_with_multiple_notes']}
+    Key Metrics:
+    • Average Polyphony: {analysis_result['avg_polyphony']:.2f}
+    • Maximum Simultaneous Notes: {analysis_result['max_polyphony']}
+    • Chord Ratio: {analysis_result['chord_ratio']*100:.1f}%
+    • Total Time Points: {analysis_result['total_time_points']}
+    • Times with Multiple Notes: {analysis_result['times_with_multiple_notes']}
 
-Classification Logic:
-• CHORD PROGRESSION: Avg polyphony ≥ 1.5 OR chord ratio ≥ 15%
-• MELODY: Avg polyphony < 1.5 AND chord ratio < 15%
+    Classification Logic:
+    • CHORD PROGRESSION: Avg polyphony ≥ 1.5 OR chord ratio ≥ 15%
+    • MELODY: Avg polyphony < 1.5 AND chord ratio < 15%
 
-Note: Timing has been normalized using the same stretching algorithm
-as the melody analysis to ensure consistency across the system.
-Timing resolution: 0.25 beats (quarter-note precision)
-"""
+    Note: Timing has been normalized using the same stretching algorithm
+    as the melody analysis to ensure consistency across the system.
+    Timing resolution: 0.25 beats (quarter-note precision)
+    """
     
-    # Add background box
-    bbox_props = dict(boxstyle="round,pad=0.3", facecolor=color, alpha=0.3)
-    ax3.text(0.5, 0.5, result_text, transform=ax3.transAxes, fontsize=12,
-             verticalalignment='center', horizontalalignment='center',
-             bbox=bbox_props, family='monospace')
+        # Add background box
+        bbox_props = dict(boxstyle="round,pad=0.3", facecolor=color, alpha=0.3)
+        ax3.text(0.5, 0.5, result_text, transform=ax3.transAxes, fontsize=12,
+                 verticalalignment='center', horizontalalignment='center',
+                 bbox=bbox_props, family='monospace')
     
-    plt.tight_layout()
-    plt.savefig(viz_path, dpi=300, bbox_inches='tight')
-    plt.close()
+        fig.tight_layout()
+        fig.savefig(viz_path, dpi=dpi, bbox_inches='tight', pil_kwargs={'optimize': True})
     
     print(f"📊 Chord/Melody visualization saved: {viz_path}")
     return viz_filename
 
 # Legacy function for backward compatibility
-def detect_midi_type(midi_file):
+def detect_midi_type(midi_file, midi_data=None):
     """
-    Original function - now calls the enhanced version but returns only classification.
+    Original function - now calls the enhanced version but returns only classification
+    (skipping the visualization render).
     """
-    classification, _ = detect_midi_type_with_stretching_and_viz(midi_file)
+    classification, _ = detect_midi_type_with_stretching_and_viz(midi_file, visualize=False, midi_data=midi_data)
     return classification
 
+def detect_and_analyze_midi(midi_file):
+    """
+    Detect the MIDI type and run the matching analysis, parsing the file only once.
+    midi_file may be a path or a binary file-like object.
+    
+    Returns:
+        (midi_type, analysis) where analysis is the result of
+        analyze_chord_progression_with_stretching for chord progressions and
+        of force_exactly_8_chords_analysis otherwise
+    """
+    from melody_analyzer2 import force_exactly_8_chords_analysis, load_midi
+    from chord_analyzer import analyze_chord_progression_with_stretching
+    
+    midi_data = load_midi(midi_file)
+    midi_type = detect_midi_type(midi_file, midi_data=midi_data)
+    
+    if midi_type == "chord_progression":
+        return midi_type, analyze_chord_progression_with_stretching(midi_file, midi_data=midi_data)
+    return midi_type, force_exactly_8_chords_analysis(midi_file, midi_data=midi_data)
+
 if __name__ == "__main__":
     # Test with a MIDI file
     midi_file = "midi_samples/test.mid"  # Change this path
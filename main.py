@@ -1,6 +1,9 @@
 """New entry point for the refactored application."""
 
-from app.main import run_app
-
 if __name__ == "__main__":
-    run_app()
\ No newline at end of file
+    # Imported here, not at module level: spawned worker processes (the
+    # analysis pool, uvicorn workers) re-import this module and must not pull
+    # in the whole app and its TensorFlow models
+    from app.main import run_app
+    
+    run_app()
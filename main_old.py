@@ -230,7 +230,8 @@ async def analyze_melody(
             result = analyze_chord_progression_with_stretching(
                 temp_path,
                 segment_size=segment_size,
-                tolerance_beats=tolerance_beats
+                tolerance_beats=tolerance_beats,
+                visualize=True
             )
             
             print(f"✅ Chord progression analysis complete!")
@@ -27,11 +27,13 @@ FOUNDATION APPROACHES:
 """
 
 import miditoolkit
-import matplotlib.pyplot as plt
 import numpy as np
 from collections import Counter, defaultdict
 import os
 
+from numba_compat import NUMBA_AVAILABLE, njit
+from viz_utils import ensure_output_dir
+
 # COMPATIBILITY FIX - Add this after your imports
 import mido
 
@@ -49,6 +51,8 @@ mido.MidiFile.__init__ = patched_mido_init
 # Krumhansl-Kessler key profiles for key detection
 MAJOR_PROFILE = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
 MINOR_PROFILE = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+MAJOR_PROFILE_ARRAY = np.array(MAJOR_PROFILE)
+MINOR_PROFILE_ARRAY = np.array(MINOR_PROFILE)
 
 # Note names for pitch classes
 PITCH_CLASS_NAMES = {
@@ -74,13 +78,30 @@ for root in range(12):
     FOLK_CHORDS[root_name] = major_triad
     FOLK_CHORDS[root_name + 'm'] = minor_triad
 
+# Chord tones as 12-bit pitch-class bitmasks (bit n = pitch class n), so
+# membership tests are a shift-and-mask instead of a list scan
+SIMPLE_CHORD_MASKS = {name: sum(1 << pc for pc in pcs) for name, pcs in SIMPLE_CHORDS.items()}
+FOLK_CHORD_MASKS = {name: sum(1 << pc for pc in pcs) for name, pcs in FOLK_CHORDS.items()}
+
 # Scale degrees in major and minor keys
 MAJOR_SCALE_DEGREES = [0, 2, 4, 5, 7, 9, 11]
 MINOR_SCALE_DEGREES = [0, 2, 3, 5, 7, 8, 10]
 
-def extract_melody_with_timing(midi_file, tolerance_beats=0.15):
-    """Extract melody notes with timing information and emphasis scoring."""
-    midi_data = miditoolkit.MidiFile(midi_file)
+def load_midi(midi_file):
+    """Parse a MIDI file path or binary file-like object (e.g. an in-memory upload)."""
+    if hasattr(midi_file, 'read'):
+        midi_file.seek(0)
+        return miditoolkit.MidiFile(file=midi_file)
+    return miditoolkit.MidiFile(midi_file)
+
+def extract_melody_with_timing(midi_file, tolerance_beats=0.15, midi_data=None):
+    """
+    Extract melody notes with timing information and emphasis scoring.
+    midi_file may be a path or a binary file-like object; midi_data is an
+    already-parsed miditoolkit.MidiFile of it (parsed here if None).
+    """
+    if midi_data is None:
+        midi_data = load_midi(midi_file)
     print(f"Analyzing melody: {midi_file}")
     print(f"Ticks per beat: {midi_data.ticks_per_beat}")
     
@@ -133,25 +154,58 @@ def detect_key_from_melody(notes):
     
     total_weight = sum(pc_weights)
     if total_weight > 0:
-        pc_dist = [w / total_weight for w in pc_weights]
+        pc_dist = np.array([w / total_weight for w in pc_weights])
     else:
         return None, 0
     
-    best_key = None
-    best_correlation = -1
+    best_root, best_is_minor, best_correlation = _best_key_correlation(
+        pc_dist, MAJOR_PROFILE_ARRAY, MINOR_PROFILE_ARRAY
+    )
+    if best_root < 0:
+        return None, -1
+    
+    best_key = PITCH_CLASS_NAMES[best_root] + ('m' if best_is_minor else '')
+    return best_key, float(best_correlation)
+
+@njit(cache=True)
+def _best_key_correlation(pc_dist, major_profile, minor_profile):
+    """
+    Correlate a pitch-class distribution with every major/minor key profile.
+    Returns (root, is_minor, correlation) of the best key; the first key wins ties.
+    """
+    best_root = -1
+    best_is_minor = False
+    best_correlation = -1.0
     
     for root in range(12):
-        major_corr = sum(pc_dist[i] * MAJOR_PROFILE[(i - root) % 12] for i in range(12))
+        major_corr = 0.0
+        for i in range(12):
+            major_corr += pc_dist[i] * major_profile[(i - root) % 12]
         if major_corr > best_correlation:
             best_correlation = major_corr
-            best_key = PITCH_CLASS_NAMES[root]
+            best_root = root
+            best_is_minor = False
         
-        minor_corr = sum(pc_dist[i] * MINOR_PROFILE[(i - root) % 12] for i in range(12))
+        minor_corr = 0.0
+        for i in range(12):
+            minor_corr += pc_dist[i] * minor_profile[(i - root) % 12]
         if minor_corr > best_correlation:
             best_correlation = minor_corr
-            best_key = PITCH_CLASS_NAMES[root] + 'm'
+            best_root = root
+            best_is_minor = True
     
-    return best_key, best_correlation
+    return best_root, best_is_minor, best_correlation
+
+@njit(cache=True)
+def _segment_mask(starts, ends, segment_start, segment_end):
+    """Which notes (given as start/end arrays) overlap the segment [segment_start, segment_end)."""
+    return (starts < segment_end) & (ends > segment_start)
+
+def warm_up():
+    """Compile the JIT kernels now (e.g. at server startup) instead of on the first analysis."""
+    if NUMBA_AVAILABLE:
+        _best_key_correlation(np.full(12, 1 / 12), MAJOR_PROFILE_ARRAY, MINOR_PROFILE_ARRAY)
+        _segment_mask(np.zeros(1), np.zeros(1), 0.0, 2.0)
 
 def get_scale_degrees_in_key(key):
     """Get the scale degrees (pitch classes) for a given key."""
@@ -220,7 +274,10 @@ def suggest_chord_simple_style(segment_notes, key, scale_degrees):
         dominant_pc = None
         dominant_note_name = None
     
+    scale_mask = sum(1 << pc for pc in set(scale_degrees))
+    
     for chord_name, chord_pcs in SIMPLE_CHORDS.items():
+        chord_mask = SIMPLE_CHORD_MASKS[chord_name]
         score = 0.0
         
         # Score based on chord tone matching
@@ -229,13 +286,13 @@ def suggest_chord_simple_style(segment_notes, key, scale_degrees):
             for pc, weight in pc_weights.items():
                 normalized_weight = weight / total_weight
                 
-                if pc in chord_pcs:
+                if chord_mask >> pc & 1:
                     score += normalized_weight * 2.0
                     if pc == chord_pcs[0]:  # Root bonus
                         score += normalized_weight * 1.0
                 else:
                     # Gentle penalty for non-chord tones
-                    if pc in scale_degrees:
+                    if scale_mask >> pc & 1:
                         score -= normalized_weight * 0.1
                     else:
                         score -= normalized_weight * 0.3
@@ -271,17 +328,20 @@ def suggest_chord_folk_style(segment_notes, key, scale_degrees):
         emphasis = calculate_note_emphasis(note)
         pc_weights[note['pitch_class']] += emphasis
     
+    scale_mask = sum(1 << pc for pc in set(scale_degrees))
+    
     for chord_name, chord_pcs in FOLK_CHORDS.items():
+        chord_mask = FOLK_CHORD_MASKS[chord_name]
         score = 0.0
         
         # Chord tone matching with emphasis on melody
         for pc, weight in pc_weights.items():
-            if pc in chord_pcs:
+            if chord_mask >> pc & 1:
                 score += weight * 1.8
                 if pc == chord_pcs[0]:  # Root
                     score += weight * 0.8
             else:
-                if pc in scale_degrees:
+                if scale_mask >> pc & 1:
                     score -= weight * 0.05  # Very lenient for scale tones (folk style)
                 else:
                     score -= weight * 0.3
@@ -597,11 +657,12 @@ def analyze_midi_melody(midi_file, segment_size=2, tolerance_beats=0.15):
     
     return key, (simple_progression, folk_progression, bass_progression, phrase_progression), (simple_avg_conf, folk_avg_conf, bass_conf, phrase_conf), all_segments
 
-def force_exactly_8_chords_analysis(midi_path):
+def force_exactly_8_chords_analysis(midi_path, midi_data=None):
     """
     HARD RULE: Always return exactly 8 chords.
     Divide the melody into exactly 8 equal segments and analyze each.
     FIXED: Ensure proper 16-beat duration for visualization.
+    midi_data: already-parsed miditoolkit.MidiFile of midi_path (parsed here if None)
     """
     from melody_analyzer2 import extract_melody_with_timing, detect_key_from_melody
     from melody_analyzer2 import suggest_chord_simple_style, suggest_chord_folk_style
@@ -610,7 +671,7 @@ def force_exactly_8_chords_analysis(midi_path):
     print("🎯 FORCE EXACTLY 8 CHORDS - Frontend Upload Mode")
 
     # Extract notes with tolerance
-    notes, ticks_per_beat = extract_melody_with_timing(midi_path, tolerance_beats=0.2)
+    notes, ticks_per_beat = extract_melody_with_timing(midi_path, tolerance_beats=0.2, midi_data=midi_data)
 
     if not notes:
         print("❌ No notes found - using default progression")
@@ -627,8 +688,12 @@ def force_exactly_8_chords_analysis(midi_path):
 
     # Find the actual start and end of musical content
     if notes:
-        music_start = min(note['start'] for note in notes)
-        music_end = max(note['end'] for note in notes)
+        # Timing columns gathered once; span and stretching are array ops
+        starts = np.array([note['start'] for note in notes])
+        ends = np.array([note['end'] for note in notes])
+        
+        music_start = starts.min()
+        music_end = ends.max()
         actual_duration = music_end - music_start
         
         print(f"🎵 Actual musical content: {music_start:.2f} → {music_end:.2f} beats ({actual_duration:.2f} beats)")
@@ -643,11 +708,12 @@ def force_exactly_8_chords_analysis(midi_path):
 
             offset = music_start
             
-            # Normalize and stretch all note timings
-            for note in notes:
-                # Remove offset and stretch
-                note['start'] = (note['start'] - offset) * stretch_factor
-                note['end'] = (note['end'] - offset) * stretch_factor
+            # Normalize and stretch all note timings (remove offset and stretch)
+            starts = (starts - offset) * stretch_factor
+            ends = (ends - offset) * stretch_factor
+            for note, start, end in zip(notes, starts.tolist(), ends.tolist()):
+                note['start'] = start
+                note['end'] = end
             
             music_start = 0.0
             music_end = 16.0
@@ -675,6 +741,11 @@ def force_exactly_8_chords_analysis(midi_path):
 
     print(f"🎯 Creating exactly 8 segments of {segment_duration} beats each:")
 
+    # Final (normalized and stretched) note timing as arrays, so each segment's
+    # notes are found with one vectorized overlap test
+    note_starts = np.array([note['start'] for note in notes], dtype=np.float64)
+    note_ends = np.array([note['end'] for note in notes], dtype=np.float64)
+
     for seg_idx in range(8):  # HARD RULE: Exactly 8 segments
         # Calculate segment boundaries - FIXED to ensure 16-beat span
         segment_start = seg_idx * segment_duration  # 0, 2, 4, 6, 8, 10, 12, 14
@@ -682,15 +753,8 @@ def force_exactly_8_chords_analysis(midi_path):
 
         print(f"  Segment {seg_idx+1}: {segment_start:.1f} → {segment_end:.1f} beats")
 
-        # Find notes in this segment (using properly stretched timing)
-        segment_notes = []
-        for note in notes:
-            note_start = note['start']  # Already normalized and stretched
-            note_end = note['end']      # Already normalized and stretched
-            
-            # Check if note overlaps with this segment
-            if (note_start < segment_end and note_end > segment_start):
-                segment_notes.append(note)
+        # Find notes overlapping this segment (using properly stretched timing)
+        segment_notes = [notes[i] for i in np.flatnonzero(_segment_mask(note_starts, note_ends, segment_start, segment_end))]
 
         if segment_notes:
             # Analyze this segment
@@ -751,7 +815,7 @@ def create_track_visualization(midi_file, segments, bass_progression, phrase_pro
     
     # Create output directory
     output_dir = "generated_visualizations"
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_output_dir(output_dir)
     
     # Get just the filename without path and extension for the title
     midi_filename = os.path.splitext(os.path.basename(midi_file))[0]
@@ -877,10 +941,11 @@ def create_track_visualization(midi_file, segments, bass_progression, phrase_pro
 
 def create_four_way_visualization(midi_file, segments, bass_progression, phrase_progression, key, notes, output_file):
     """Create visualization showing all four harmonization options."""
+    import matplotlib.pyplot as plt
     
     # Create output directory
     output_dir = "generated_visualizations"
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_output_dir(output_dir)
     
     # Get just the filename without path and extension for the title
     midi_filename = os.path.splitext(os.path.basename(midi_file))[0]
@@ -972,6 +1037,7 @@ def create_four_way_visualization(midi_file, segments, bass_progression, phrase_
     plt.xlabel('Time (beats)')
     plt.tight_layout()
     plt.savefig(output_file, dpi=150, bbox_inches='tight')
+    plt.close()
     print(f"\nVisualization saved as '{output_file}'")
 
 def main():
@@ -1,6 +1,7 @@
 # model_manager.py - Handle model loading efficiently
 
 import os
+import threading
 from magenta.models.melody_rnn import melody_rnn_sequence_generator
 from magenta.models.drums_rnn import drums_rnn_sequence_generator
 from magenta.models.shared import sequence_generator_bundle
@@ -15,6 +16,7 @@ class MagentaModelManager:
     _models_loaded = False
     _bass_rnn = None
     _drum_rnn = None
+    _load_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
@@ -22,53 +24,58 @@ class MagentaModelManager:
         return cls._instance
     
     def __init__(self):
-        # Only initialize once
-        if not self._models_loaded:
-            self.initialize_models()
+        # Models are loaded lazily on first access (or by initialize_models),
+        # so creating the instance at import time stays cheap
+        pass
     
     def initialize_models(self):
-        """Load and initialize Magenta models once."""
+        """Load and initialize Magenta models once (safe to call from several threads)."""
         if self._models_loaded:
             print("Models already loaded!")
             return
         
-        print("Loading Magenta models...")
+        with self._load_lock:
+            # Another thread may have finished loading while we waited
+            if self._models_loaded:
+                return
+            
+            print("Loading Magenta models...")
         
-        # Check if model files exist
-        bass_bundle_path = 'basic_rnn.mag'
-        drum_bundle_path = 'drum_kit_rnn.mag'
+            # Check if model files exist
+            bass_bundle_path = 'basic_rnn.mag'
+            drum_bundle_path = 'drum_kit_rnn.mag'
         
-        if not os.path.exists(bass_bundle_path):
-            download_bundle('basic_rnn.mag', '.')   
-        if not os.path.exists(drum_bundle_path):
-            download_bundle('drum_kit_rnn.mag', '.')       
+            if not os.path.exists(bass_bundle_path):
+                download_bundle('basic_rnn.mag', '.')   
+            if not os.path.exists(drum_bundle_path):
+                download_bundle('drum_kit_rnn.mag', '.')       
 
         
-        try:
-            # Load bundles
-            bass_bundle = sequence_generator_bundle.read_bundle_file(bass_bundle_path)
-            drum_bundle = sequence_generator_bundle.read_bundle_file(drum_bundle_path)
+            try:
+                # Load bundles
+                bass_bundle = sequence_generator_bundle.read_bundle_file(bass_bundle_path)
+                drum_bundle = sequence_generator_bundle.read_bundle_file(drum_bundle_path)
             
-            # Initialize generators
-            bass_map = melody_rnn_sequence_generator.get_generator_map()
-            drum_map = drums_rnn_sequence_generator.get_generator_map()
+                # Initialize generators
+                bass_map = melody_rnn_sequence_generator.get_generator_map()
+                drum_map = drums_rnn_sequence_generator.get_generator_map()
             
             
-            self._bass_rnn = bass_map['basic_rnn'](checkpoint=None, bundle=bass_bundle) # basic_rnn
-            self._drum_rnn = drum_map['drum_kit'](checkpoint=None, bundle=drum_bundle)
+                self._bass_rnn = bass_map['basic_rnn'](checkpoint=None, bundle=bass_bundle) # basic_rnn
+                self._drum_rnn = drum_map['drum_kit'](checkpoint=None, bundle=drum_bundle)
             
-            # Initialize models (this is the slow part)
-            print("Initializing bass model...")
-            self._bass_rnn.initialize()
-            print("Initializing drum model...")
-            self._drum_rnn.initialize()
+                # Initialize models (this is the slow part)
+                print("Initializing bass model...")
+                self._bass_rnn.initialize()
+                print("Initializing drum model...")
+                self._drum_rnn.initialize()
             
-            self._models_loaded = True
-            print("All Magenta models loaded successfully!")
+                self._models_loaded = True
+                print("All Magenta models loaded successfully!")
             
-        except Exception as e:
-            print(f"Error loading models: {e}")
-            raise
+            except Exception as e:
+                print(f"Error loading models: {e}")
+                raise
     
     @property
     def bass_rnn(self):
@@ -88,7 +95,7 @@ class MagentaModelManager:
         """Check if models are loaded."""
         return self._models_loaded
 
-# Global instance - models loaded once per Python session
+# Global instance - models loaded once per Python session, on first use
 model_manager = MagentaModelManager()
 
 def get_models():
@@ -0,0 +1,13 @@
+# numba_compat.py - Optional Numba JIT, with a pass-through fallback
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # Numba is optional - fall back to plain Python loops
+    NUMBA_AVAILABLE = False
+    
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
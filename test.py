@@ -129,8 +129,6 @@ def main():
             bpm=bpm,
             bass_complexity=bass_complexity,
             drum_complexity=drum_complexity,
-            hi_hat_divisions=2,
-            snare_beats=(2, 4),
             output_file=output_file
         )
         
@@ -0,0 +1,104 @@
+"""Tests for the byte-level note scan behind MIDI type classification."""
+
+import glob
+import io
+import os
+import struct
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from chord_or_melody import _quick_note_ticks, _scan_note_ticks
+from melody_analyzer2 import extract_melody_with_timing
+
+MIDI_SAMPLES = sorted(glob.glob(os.path.join(ROOT_DIR, "midi_samples", "*.mid")))
+
+END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+def _smf(track_events, division=480):
+    """A single-track Standard MIDI File around the given track event bytes."""
+    header = b"MThd" + struct.pack(">LhhH", 6, 0, 1, division)
+    return header + b"MTrk" + struct.pack(">L", len(track_events)) + track_events
+
+
+def _scanned_notes(scanned):
+    ticks_per_beat, starts, ends, pitches = scanned
+    return sorted(zip(starts.tolist(), ends.tolist(), pitches.tolist())), ticks_per_beat
+
+
+@pytest.mark.parametrize("midi_file", MIDI_SAMPLES, ids=os.path.basename)
+def test_scan_matches_miditoolkit_notes(midi_file):
+    with open(midi_file, "rb") as f:
+        scanned = _scan_note_ticks(f.read())
+    assert scanned is not None
+
+    ticks_per_beat, starts, ends, pitches = scanned
+    notes, expected_ticks_per_beat = extract_melody_with_timing(midi_file)
+
+    assert ticks_per_beat == expected_ticks_per_beat
+    assert sorted(zip((starts / ticks_per_beat).tolist(), (ends / ticks_per_beat).tolist(), pitches.tolist())) == \
+        sorted((note["start"], note["end"], note["pitch"]) for note in notes)
+
+
+def test_scan_running_status_and_velocity_zero_note_off():
+    # Note-on C4, then running-status note-on E4, then both closed by
+    # running-status note-ons with velocity 0
+    data = _smf(
+        b"\x00\x90\x3c\x64"
+        b"\x00\x40\x64"
+        b"\x83\x60\x3c\x00"
+        b"\x00\x40\x00"
+        + END_OF_TRACK
+    )
+
+    notes, ticks_per_beat = _scanned_notes(_scan_note_ticks(data))
+
+    assert ticks_per_beat == 480
+    assert notes == [(0, 480, 60), (0, 480, 64)]
+
+
+def test_scan_pairs_repeated_notes_first_in_first_out():
+    # Two overlapping C4 note-ons on one channel, closed by note-off events
+    data = _smf(
+        b"\x00\x90\x3c\x64"
+        b"\x60\x90\x3c\x64"
+        b"\x60\x80\x3c\x40"
+        b"\x60\x80\x3c\x40"
+        + END_OF_TRACK
+    )
+
+    notes, _ = _scanned_notes(_scan_note_ticks(data))
+
+    assert notes == [(0, 96 * 2, 60), (96, 96 * 3, 60)]
+
+
+def test_scan_skips_meta_and_sysex_events():
+    data = _smf(
+        b"\x00\xff\x51\x03\x07\xa1\x20"   # Tempo meta event
+        b"\x00\xf0\x03\x7e\x7f\xf7"       # Sysex
+        b"\x00\x90\x3c\x64"
+        b"\x60\x3c\x00"
+        + END_OF_TRACK
+    )
+
+    notes, _ = _scanned_notes(_scan_note_ticks(data))
+
+    assert notes == [(0, 96, 60)]
+
+
+def test_scan_rejects_smpte_division():
+    # Negative division: SMPTE frames (-25 fps, 40 ticks per frame)
+    data = _smf(b"\x00\x90\x3c\x64\x60\x3c\x00" + END_OF_TRACK, division=0xE728)
+
+    assert _scan_note_ticks(data) is None
+
+
+def test_quick_scan_falls_back_on_truncated_file():
+    data = _smf(b"\x00\x90\x3c\x64\x60\x3c\x00" + END_OF_TRACK)
+
+    assert _quick_note_ticks(io.BytesIO(data[:-6])) is None
+    assert _quick_note_ticks(io.BytesIO(data[:20])) is None
@@ -0,0 +1,57 @@
+"""Tests for the /full-analysis workflow on chord progression input."""
+
+import asyncio
+import io
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+CHORD_SAMPLE = os.path.join(ROOT_DIR, "midi_samples", "C_G_A_F.mid")
+
+
+def test_detect_and_analyze_chord_sample_returns_result_dict():
+    from chord_or_melody import detect_and_analyze_midi
+
+    midi_type, analysis = detect_and_analyze_midi(CHORD_SAMPLE)
+
+    assert midi_type == "chord_progression"
+    assert isinstance(analysis, dict)
+    assert len(analysis["chord_progression"]) == 8
+
+
+def test_full_analysis_with_chord_sample(monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi import UploadFile
+
+    from app.services import arrangement_service as service_module
+    from app.utils.helpers import ResultCache
+
+    generated = {}
+
+    async def run_in_process(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def fake_generation(**kwargs):
+        generated.update(kwargs)
+        return kwargs["output_file"]
+
+    monkeypatch.setattr(service_module.model_service, "is_loaded", lambda: True)
+    monkeypatch.setattr(service_module.model_service, "get_bass_rnn", lambda: None)
+    monkeypatch.setattr(service_module.model_service, "get_drum_rnn", lambda: None)
+    monkeypatch.setattr(service_module, "run_cpu_bound", run_in_process)
+    monkeypatch.setattr(service_module, "_run_generation", fake_generation)
+    monkeypatch.setattr(service_module, "analysis_cache", ResultCache())
+
+    with open(CHORD_SAMPLE, "rb") as f:
+        upload = UploadFile(file=io.BytesIO(f.read()), filename="C_G_A_F.mid")
+
+    result = asyncio.run(service_module.arrangement_service.full_analysis_and_generation(upload))
+
+    assert result["analysis"]["type"] == "chord_progression"
+    assert len(result["chord_progression"]) == 8
+    assert all(isinstance(chord, str) for chord in result["chord_progression"])
+    assert generated["chord_progression"] == result["chord_progression"]
@@ -0,0 +1,51 @@
+"""Tests for the per-key locking in ResultCache."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+def test_failed_compute_keeps_waiters_and_later_callers_on_one_lock():
+    pytest.importorskip("fastapi")
+    from app.utils.helpers import ResultCache
+
+    cache = ResultCache()
+    running = 0
+    max_running = 0
+    calls = []
+
+    async def compute(fail):
+        nonlocal running, max_running
+        calls.append(fail)
+        running += 1
+        max_running = max(max_running, running)
+        try:
+            await asyncio.sleep(0.01)
+            if fail:
+                raise RuntimeError("analysis failed")
+            return "result"
+        finally:
+            running -= 1
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_compute("key", lambda: compute(True)))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_compute("key", lambda: compute(False)))
+        await asyncio.sleep(0)
+
+        with pytest.raises(RuntimeError):
+            await first
+
+        # Arrives while the waiter recomputes: must share its lock, not start another computation
+        late = asyncio.ensure_future(cache.get_or_compute("key", lambda: compute(False)))
+        return await waiter, await late
+
+    assert asyncio.run(main()) == ("result", "result")
+    assert calls == [True, False]
+    assert max_running == 1
+    assert cache._locks == {}
@@ -0,0 +1,44 @@
+# viz_utils.py - Helpers shared by the analyzers' visualization code
+
+import os
+import threading
+from contextlib import contextmanager
+
+# Output directories already created by this process, so repeated
+# visualizations skip the makedirs() stat
+_READY_OUTPUT_DIRS = set()
+
+# Figures reused across renders (cleared each time) instead of a new one per
+# call, keyed by figsize; each is paired with the lock that guards drawing on it
+_SHARED_FIGURES = {}
+_SHARED_FIGURES_LOCK = threading.Lock()
+
+def ensure_output_dir(output_dir):
+    """Create output_dir the first time it is used in this process."""
+    if output_dir not in _READY_OUTPUT_DIRS:
+        os.makedirs(output_dir, exist_ok=True)
+        _READY_OUTPUT_DIRS.add(output_dir)
+
+@contextmanager
+def shared_figure(figsize):
+    """
+    Borrow the shared Figure of the given size, cleared and ready to draw on.
+    
+    The figure is locked for the duration of the with-block, so two threads
+    never draw on it at once; save it before leaving the block.
+    
+    Args:
+        figsize: (width, height) in inches
+    """
+    with _SHARED_FIGURES_LOCK:
+        entry = _SHARED_FIGURES.get(figsize)
+        if entry is None:
+            # Imported here so classification-only callers never load matplotlib;
+            # a bare Figure renders through Agg without probing for a GUI backend
+            from matplotlib.figure import Figure
+            entry = _SHARED_FIGURES[figsize] = (Figure(figsize=figsize), threading.Lock())
+    
+    fig, lock = entry
+    with lock:
+        fig.clear()
+        yield fig